@@ -0,0 +1,103 @@
+import collections
+
+
+class Aggregator:
+    def __init__(self, max_entries=500, max_samples=3):
+        self.max_entries = max_entries
+        self.max_samples = max_samples
+
+        self.__entries = collections.OrderedDict()
+        self.__overflow = collections.OrderedDict()
+        self.__dropped = 0
+        self.count = 0
+
+
+    def __len__(self):
+        return self.count
+
+
+    @staticmethod
+    def key(alert):
+        return (
+            alert.get('alert', {}).get('signature_id'),
+            alert.get('src_ip'),
+            alert.get('dest_ip'),
+            alert.get('flow_id'),
+            # Flow ids are per sensor (see minimal.Parser)
+            alert.get('sensor')
+        )
+
+
+    def add(self, alert):
+        # Collapse duplicates of the same signature, endpoints and flow into a single entry
+
+        key = Aggregator.key(alert)
+        timestamp = alert.get('timestamp', '')
+        self.count += 1
+
+        entry = self.__entries.get(key)
+        if entry is not None:
+            self.__entries.move_to_end(key)
+            entry['count'] += 1
+            entry['first_seen'] = min(entry['first_seen'], timestamp)
+            entry['last_seen'] = max(entry['last_seen'], timestamp)
+            if len(entry['samples']) < self.max_samples:
+                entry['samples'] += [alert]
+            return
+
+        self.__entries[key] = {
+            'signature_id': key[0],
+            'signature': alert.get('alert', {}).get('signature'),
+            'src_ip': key[1],
+            'dest_ip': key[2],
+            'flow_id': key[3],
+            'sensor': key[4],
+            'count': 1,
+            'first_seen': timestamp,
+            'last_seen': timestamp,
+            'samples': [alert]
+        }
+
+        # Bound memory by folding the least recently seen entry into a per signature summary
+        if len(self.__entries) > self.max_entries:
+            _, evicted = self.__entries.popitem(last=False)
+            self.__evict(evicted)
+
+
+    def __evict(self, entry):
+        overflow = self.__overflow.get(entry['signature_id'])
+        if overflow is None:
+            if len(self.__overflow) >= self.max_entries:
+                self.__dropped += entry['count']
+                return
+
+            self.__overflow[entry['signature_id']] = {
+                'signature_id': entry['signature_id'],
+                'signature': entry['signature'],
+                'count': entry['count'],
+                'flows': 1,
+                'first_seen': entry['first_seen'],
+                'last_seen': entry['last_seen']
+            }
+            return
+
+        overflow['count'] += entry['count']
+        overflow['flows'] += 1
+        overflow['first_seen'] = min(overflow['first_seen'], entry['first_seen'])
+        overflow['last_seen'] = max(overflow['last_seen'], entry['last_seen'])
+
+
+    def flush(self):
+        # Return and reset the aggregated entries, the per signature summaries of evicted entries
+        # and the number of alerts dropped entirely
+
+        entries = sorted(self.__entries.values(), key=lambda e: e['first_seen'])
+        overflow = list(self.__overflow.values())
+        dropped = self.__dropped
+
+        self.__entries = collections.OrderedDict()
+        self.__overflow = collections.OrderedDict()
+        self.__dropped = 0
+        self.count = 0
+
+        return entries, overflow, dropped
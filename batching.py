@@ -0,0 +1,130 @@
+import aggregate
+import metrics
+
+import logging
+import queue
+import time
+
+
+def bucket(value, bounds, unit=''):
+    for bound in bounds:
+        if value <= bound:
+            return f'le-{bound}{unit}'
+    return f'gt-{bounds[-1]}{unit}'
+
+
+class Batcher:
+    def __init__(self, alert_queue, window=300, max_size=1000, urgent_severity=1, decode=None):
+        self.alert_queue = alert_queue
+
+        # Alerts are sent at most once per window unless the batch reaches max_size alerts
+        # or an alert has a severity of urgent_severity or higher (ie numerically lower, 0 disables)
+        self.window = window
+        self.max_size = max_size
+        self.urgent_severity = urgent_severity
+        self.decode = decode
+
+        self.__stopped = False
+
+
+    def stop(self):
+        # Wakes up the blocked run loop, alerts queued before this are still sent.  Only done once as the
+        # queue counts the sentinel as unfinished and a second one would never be consumed.
+        if self.__stopped:
+            return
+        self.__stopped = True
+        self.alert_queue.put(None)
+
+
+    def urgent(self, alert):
+        severity = alert.get('alert', {}).get('severity')
+        return isinstance(severity, int) and severity <= self.urgent_severity
+
+
+    def run(self, send):
+        aggregator = aggregate.Aggregator()
+
+        stats = metrics.registry.stats('notifier')
+        last_stats = time.time()
+
+        last_flush = time.monotonic()
+        first = None
+
+        # When the alerts of the current batch were queued (where known)
+        queued = []
+
+        # Alerts of the current batch that are not in the journal (ie saved to it if the batch can't be sent)
+        unsent = []
+
+        def flush(reason):
+            nonlocal first, last_flush, last_stats, queued, unsent
+
+            size = len(aggregator)
+            send(aggregator)
+            now = time.monotonic()
+
+            sent = time.time()
+            for t in queued:
+                metrics.mailed_latency.observe(sent - t)
+            queued = []
+            unsent = []
+
+            # Journaled alerts are only removed once sent
+            self.alert_queue.ack()
+
+            stats[f'flushes-{reason}'] += 1
+            stats['batch-size-' + bucket(size, [1, 10, 100, 1000, 10000])] += 1
+            stats['flush-latency-' + bucket(now - first, [1, 10, 60, 300, 600], 's')] += 1
+
+            first = None
+            last_flush = now
+
+            if time.time() - last_stats >= 3600:
+                metrics.registry.log(stats)
+                last_stats = time.time()
+
+        try:
+            while True:
+                # Block indefinitely while idle, otherwise until the window expires
+                timeout = None
+                if first is not None:
+                    timeout = max(0, last_flush + self.window - time.monotonic())
+
+                try:
+                    item, t = self.alert_queue.get_timed(timeout=timeout)
+                except queue.Empty:
+                    flush('window')
+                    continue
+
+                self.alert_queue.task_done()
+                if item is None:
+                    break
+
+                alert = self.decode(item) if self.decode is not None else item
+                if alert is None:
+                    continue
+
+                aggregator.add(alert)
+                if t is not None:
+                    queued += [t]
+                    unsent += [item]
+                if first is None:
+                    first = time.monotonic()
+
+                if self.urgent(alert):
+                    flush('urgent')
+                elif len(aggregator) >= self.max_size:
+                    flush('size')
+
+            if len(aggregator) > 0:
+                flush('stop')
+
+        except Exception as e:
+            # Eg the mail server still unreachable when stopping (sends are then only retried a few times).  The
+            # batch is not acknowledged, ie its journaled alerts are resent on restart, and its other alerts and
+            # those still queued are saved to the journal.
+            logging.error('failed to send alerts, notifier stopping: %s', e)
+            for item in self.alert_queue.spill(unsent):
+                logging.error('unhandled alert: %s', item)
+            if self.alert_queue.path is not None:
+                logging.error('pending alerts saved to %s', self.alert_queue.path)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import evefile
+import synthetic
+
+import argparse
+import collections
+import json
+import tempfile
+import time
+
+
+def readline_legacy(path):
+    # The previous approach: a tell/readline pair per line (one line per inotify event)
+    count = 0
+    with open(path, 'r', encoding='utf-8') as file:
+        while True:
+            pos = file.tell()
+            line = file.readline()
+            if line == '':
+                break
+            if not line.endswith('\n'):
+                file.seek(pos)
+                break
+            count += 1
+    return count
+
+
+def reader_bulk(path):
+    count = 0
+    reader = evefile.EveReader(path)
+    for line in reader.lines():
+        count += 1
+    reader.close()
+    return count
+
+
+def reader_decode_all(path):
+    # Full json decoding of every line to check the event type
+    count = 0
+    reader = evefile.EveReader(path)
+    for line in reader.lines():
+        json.loads(line).get('event_type') == 'alert'
+        count += 1
+    reader.close()
+    return count
+
+
+def reader_prefilter(path):
+    stats = collections.defaultdict(int)
+    count = 0
+    reader = evefile.EveReader(path)
+    for line in reader.lines():
+        evefile.parse_alert(line, stats)
+        count += 1
+    reader.close()
+    print(f'{"":>16}  {dict(stats)}')
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', '-n', type=int, default=500000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'eve.json')
+        synthetic.generate(path, args.lines)
+        size = os.path.getsize(path)
+
+        for name, func in [('readline-legacy', readline_legacy), ('reader-bulk', reader_bulk),
+                           ('decode-all', reader_decode_all), ('prefilter', reader_prefilter)]:
+            start = time.perf_counter()
+            count = func(path)
+            elapsed = time.perf_counter() - start
+            assert count == args.lines
+
+            print(f'{name:>16}: {count / elapsed:12.0f} lines/sec {size / elapsed / 1024**2:8.1f} MB/sec')
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import evetime
+
+import argparse
+import datetime
+import random
+import time
+
+
+def timestamps(count, flows):
+    # Pairs of flow.start and timestamp as used by the elastic mode Kibana urls
+    base = datetime.datetime(2021, 2, 20, 21, 21, 6, tzinfo=datetime.timezone(-datetime.timedelta(hours=5)))
+    starts = [base + datetime.timedelta(seconds=random.uniform(0, 86400)) for _ in range(flows)]
+
+    pairs = []
+    for _ in range(count):
+        start = random.choice(starts)
+        timestamp = start + datetime.timedelta(seconds=random.uniform(0, 600))
+        pairs += [(start.strftime('%Y-%m-%dT%H:%M:%S.%f%z'), timestamp.strftime('%Y-%m-%dT%H:%M:%S.%f%z'))]
+    return pairs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--alerts', '-n', type=int, default=10000)
+    parser.add_argument('--flows', '-f', type=int, default=2000)
+    args = parser.parse_args()
+
+    pairs = timestamps(args.alerts, args.flows)
+
+    parsers = [
+        ('strptime', lambda t: datetime.datetime.strptime(t, '%Y-%m-%dT%H:%M:%S.%f%z')),
+        ('evetime', evetime.parse)
+    ]
+
+    try:
+        start = time.perf_counter()
+        import dateparser
+        print(f'{"dateparser":>10}: import {time.perf_counter() - start:.3f}s')
+        parsers = [('dateparser', dateparser.parse)] + parsers
+    except ImportError:
+        print(f'{"dateparser":>10}: not installed')
+
+    for name, parse in parsers:
+        evetime.parse.cache_clear()
+
+        start = time.perf_counter()
+        for flowstart, timestamp in pairs:
+            assert parse(flowstart) <= parse(timestamp)
+        elapsed = time.perf_counter() - start
+
+        print(f'{name:>10}: {elapsed:.3f}s for {args.alerts} alerts, {elapsed / args.alerts / 2 * 1e6:.2f}us per timestamp')
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import evefile
+import flowtable
+import synthetic
+import topk
+
+import argparse
+import collections
+import tempfile
+import time
+import tracemalloc
+
+
+def drain(path, flows):
+    # As minimal.Parser drains the file
+    stats = collections.defaultdict(int)
+    count = 0
+    now = time.monotonic()
+    reader = evefile.EveReader(path)
+    for line in reader.lines():
+        t = evefile.event_type(line)
+        if flows is not None and t in flowtable.EVENT_TYPES:
+            flows.update(t, line, now)
+        else:
+            evefile.parse_alert(line, stats, t)
+        count += 1
+    reader.close()
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', '-n', type=int, default=500000)
+    parser.add_argument('--flows', '-f', type=int, default=100000, help='distinct flow ids')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'eve.json')
+        synthetic.generate(path, args.lines, flows=args.flows)
+
+        talkers = topk.TopTalkers(os.path.join(tmpdir, 'top-talkers.json'))
+        for name, flows in [('without-table', None), ('with-table', flowtable.FlowTable(args.flows)),
+                            ('with-talkers', flowtable.FlowTable(args.flows, talkers=talkers))]:
+            start = time.perf_counter()
+            count = drain(path, flows)
+            elapsed = time.perf_counter() - start
+            assert count == args.lines
+
+            print(f'{name:>16}: {count / elapsed:12.0f} lines/sec')
+
+        # Measured (rather than estimated) memory of the tracked flows
+        tracemalloc.start()
+        flows = flowtable.FlowTable(args.flows)
+        before = tracemalloc.get_traced_memory()[0]
+        drain(path, flows)
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+
+        print(f'{"flows":>16}: {len(flows)} tracked, {used / len(flows):.0f} bytes/flow measured, '
+              f'{flows.memory()} bytes/flow estimated')
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ndjson
+
+import argparse
+import random
+import time
+
+
+def concat_splitlines(chunks):
+    # The previous elastic.ListenerWorker approach
+    count = 0
+    buf = b''
+    for b in chunks:
+        buf += b
+        lines = buf.splitlines(keepends=True)
+        buf = b''
+        if lines[-1][-1] != ord('\n'):
+            buf = lines[-1]
+            lines = lines[:-1]
+        for line in lines:
+            count += 1
+    return count
+
+
+def framer(chunks):
+    count = 0
+    f = ndjson.Framer(max_record_size=64*1024*1024)
+    for b in chunks:
+        for record in f.feed(b):
+            count += 1
+    return count
+
+
+def check_restarts(max_record_size=1000, seed=1):
+    # Resuming from consumed (as the eve.json checkpoint does) after any feed yields exactly the remaining
+    # records, including when oversized records are dropped across several feeds
+
+    rng = random.Random(seed)
+    records = [b'%d:' % i + b'x' * rng.choice([0, 10, 100, max_record_size, 2 * max_record_size, 5 * max_record_size])
+               for i in range(1000)]
+    data = b''.join([r + b'\n' for r in records])
+    expected = [r for r in records if len(r) <= max_record_size]
+
+    f = ndjson.Framer(max_record_size=max_record_size)
+    restarts = []
+    offset, yielded = 0, 0
+    while offset < len(data):
+        chunk = data[offset:offset + rng.choice([1, 7, 100, 1500, 8000])]
+        offset += len(chunk)
+        yielded += len(list(f.feed(chunk)))
+        restarts += [(f.consumed, yielded)]
+    assert yielded == len(expected)
+
+    for consumed, yielded in rng.sample(restarts, 200):
+        resumed = list(ndjson.Framer(max_record_size=max_record_size).feed(data[consumed:]))
+        assert resumed == expected[yielded:], f'restart from {consumed} after {yielded} records'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--megabytes', '-m', type=int, default=64)
+    args = parser.parse_args()
+
+    check_restarts()
+
+    total = args.megabytes * 1024**2
+
+    for record_size in [200, 4*1024, 1024**2, 8*1024**2]:
+        record = b'{"event_type":"alert","x":"' + b'x' * (record_size - 30) + b'"}\n'
+        data = record * (total // len(record))
+
+        for chunk_size in [1024, 64*1024]:
+            chunks = [data[i:i+chunk_size] for i in range(0, len(data), chunk_size)]
+
+            for name, func in [('concat-splitlines', concat_splitlines), ('framer', framer)]:
+                # The quadratic path becomes impractical for huge records in small reads
+                if func is concat_splitlines and record_size // chunk_size > 256:
+                    print(f'{name:>18} record {record_size:>8}B read {chunk_size:>6}B: skipped')
+                    continue
+
+                start = time.perf_counter()
+                count = func(chunks)
+                elapsed = time.perf_counter() - start
+                assert count == total // len(record)
+
+                print(f'{name:>18} record {record_size:>8}B read {chunk_size:>6}B: '
+                      f'{count / elapsed:12.0f} records/sec {len(data) / elapsed / 1024**2:8.1f} MB/sec')
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'crons'))
+
+import elasticsearch
+import report
+import rollup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import httpclient
+
+import stubs
+
+import argparse
+import collections
+import datetime
+import importlib.util
+import logging
+import tempfile
+import time
+
+
+def load_http_stats():
+    # crons/http-stats.py isn't importable by name
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'crons', 'http-stats.py')
+    spec = importlib.util.spec_from_file_location('http_stats', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def sequential(http_stats, start, end):
+    # As the cron did before the per day rollups: every event of the window scanned per event type,
+    # then the flows looked up and the connections and bandwidth summed per hostname
+
+    entries = {}
+    for event_type, field in http_stats.FIELDS.items():
+        section, key = field.split('.')
+        query = {'size': 5000, 'query': http_stats.event_query(event_type, start, end), 'sort': [{'timestamp': 'asc'}]}
+
+        hostnames = {}
+        for record in elasticsearch.search(query, start, end, source=['flow_id', field]):
+            if key not in record['_source'].get(section, {}):
+                continue
+            hostnames[record['_source']['flow_id']] = record['_source'][section][key]
+
+        flow_bytes = elasticsearch.flow_bytes(list(hostnames.keys()), start, end)
+
+        by_count, by_bandwidth = collections.defaultdict(int), collections.defaultdict(int)
+        for flow_id, hostname in hostnames.items():
+            by_count[hostname] += 1
+            by_bandwidth[hostname] += flow_bytes.get(flow_id, 0)
+        entries[event_type] = (by_count, by_bandwidth)
+
+    return entries
+
+
+def concurrent(http_stats, days, today, client_side, workers):
+    # As the cron does now: per day rollups (computed concurrently) merged
+
+    rollups = rollup.collect('http-stats', days, lambda d: http_stats.summarize(d, client_side, workers), today)
+    merged = rollup.merge(rollups)
+
+    entries = {}
+    for event_type in http_stats.FIELDS:
+        e = merged.get(event_type, {})
+        entries[event_type] = ({h: v[0] for h, v in e.items()}, {h: v[1] for h, v in e.items()})
+    return entries
+
+
+def render(entries):
+    return report.render([
+        ('http connections', 'http.hostname', entries['http'][0], str),
+        ('http bandwidth',   'http.hostname', entries['http'][1], report.filesize),
+        ('tls connections',  'tls.sni',       entries['tls'][0],  str),
+        ('tls bandwidth',    'tls.sni',       entries['tls'][1],  report.filesize)
+    ], lambda field, hostname: f'https://kibana.invalid/?q={field}:{hostname}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--flows', '-f', type=int, default=20000)
+    parser.add_argument('--days', '-d', type=int, default=7)
+    parser.add_argument('--workers', '-w', type=int, default=4)
+    args = parser.parse_args()
+
+    # The client side scan warns of every http record without a hostname (as the fixture has)
+    logging.basicConfig(level=logging.ERROR)
+
+    # Fixed days so that the fixture (and so the report) is the same on every run
+    today = datetime.date(2021, 2, 20)
+    days = [today - datetime.timedelta(days=i) for i in range(args.days, -1, -1)]
+    start = datetime.datetime.combine(days[0], datetime.time())
+    end = datetime.datetime.combine(today, datetime.time()) + datetime.timedelta(days=1)
+
+    # The actual requests are made (to a stand-in answering them over the fixture), with more buckets and
+    # records per day than fit in a page
+    fixture = stubs.HTTPStatsFixture(days, flows=args.flows)
+    server = fixture.load(stubs.ElasticsearchServer()).start()
+    httpclient.ELASTICSEARCH_URL = server.url
+
+    http_stats = load_http_stats()
+
+    # Each flow counted once however many days its events span
+    expected = render(fixture.totals(start, end))
+
+    began = time.perf_counter()
+    body = render(sequential(http_stats, start, end))
+    print(f'{"sequential:":<13} {time.perf_counter() - began:.3f}s {len(body)} bytes, '
+          f'{"identical" if body == expected else "DIFFERENT"}')
+    assert body == expected
+
+    for client_side in [False, True]:
+        # Rollups stored away from crons/rollups (and computed afresh for each path)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            rollup.ROLLUP_DIR = tmpdir
+
+            began = time.perf_counter()
+            body = render(concurrent(http_stats, days, today, client_side, args.workers))
+            elapsed = time.perf_counter() - began
+
+        name = 'client side:' if client_side else 'aggregated:'
+        print(f'{name:<13} {elapsed:.3f}s {len(body)} bytes, {"identical" if body == expected else "DIFFERENT"}')
+        assert body == expected
+
+    print(', '.join([f'{k} = {v}' for k, v in sorted(server.searches.items())]))
+    assert server.searches['composite-pages-after'] > 0 and server.searches['search-pages-after'] > 0
+    server.stop()
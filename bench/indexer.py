@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import evefile
+import httpclient
+import indexer
+import stubs
+import synthetic
+
+import argparse
+import logging
+import tempfile
+import time
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', '-n', type=int, default=200000)
+    parser.add_argument('--workers', '-w', type=int, nargs='+', default=[1, 2, 4], help='requests in flight')
+    parser.add_argument('--reject-ratio', type=float, default=0.0, help='documents rejected with 429s')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'eve.json')
+        # Spanning a few days (ie routed to several indices)
+        synthetic.generate(path, args.lines, start=time.time() - 3 * 86400, spread=3 * 86400)
+
+        for workers in args.workers:
+            server = stubs.ElasticsearchServer(reject_ratio=args.reject_ratio).start()
+            bulk = indexer.BulkWriter(httpclient.Client(server.url), workers=workers)
+
+            start = time.perf_counter()
+            reader = evefile.EveReader(path)
+            for line in reader.lines():
+                bulk.add(line)
+            reader.close()
+            bulk.close()
+            elapsed = time.perf_counter() - start
+
+            assert sum(server.indices.values()) == args.lines
+            server.stop()
+
+            print(f'{workers:4d} workers: {args.lines / elapsed:10.0f} lines/sec {server.requests:6d} requests '
+                  f'{server.rejected:6d} rejected, indices {", ".join(sorted(server.indices.keys()))}')
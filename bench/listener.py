@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import elastic
+
+import argparse
+import json
+import logging
+import socket
+import threading
+import time
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def client(port, lines, payload):
+    # Imitate a logstash tcp output (json_lines codec) sending in bursts
+    sock = socket.create_connection(('127.0.0.1', port))
+    batch = payload * 100
+    for _ in range(lines // 100):
+        sock.sendall(batch)
+    sock.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', '-n', type=int, default=20000, help='lines per connection')
+    parser.add_argument('--connections', '-c', type=int, nargs='+', default=[1, 4, 16, 64])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    record = {
+        'timestamp': '2021-02-20T21:21:06.695534-0500',
+        'flow_id': 1700754495777475,
+        'event_type': 'alert',
+        'src_ip': '101.99.95.201',
+        'dest_ip': '192.168.1.65',
+        'alert': {'signature_id': 2520000, 'signature': 'ET TOR Known Tor Exit Node Traffic group 1'},
+        'flow': {'start': '2021-02-20T21:21:06.273091-0500'}
+    }
+    payload = (json.dumps(record) + '\n').encode()
+
+    for connections in args.connections:
+        port = free_port()
+        listener = elastic.Listener(port=port); listener.start()
+        time.sleep(0.5)
+
+        total = connections * (args.lines // 100 * 100)
+        start = time.perf_counter()
+
+        clients = [threading.Thread(target=client, args=(port, args.lines, payload)) for _ in range(connections)]
+        for c in clients:
+            c.start()
+
+        received = 0
+        while received < total:
+            elastic.alert_queue.get()
+            elastic.alert_queue.task_done()
+            received += 1
+
+        elapsed = time.perf_counter() - start
+        for c in clients:
+            c.join()
+        listener.stop(); listener.join()
+
+        print(f'{connections:4d} connections: {received / elapsed:10.0f} lines/sec '
+              f'{received * len(payload) / elapsed / 1024**2:8.1f} MB/sec')
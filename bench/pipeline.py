@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import stubs
+import synthetic
+
+import argparse
+import logging
+import multiprocessing
+import resource
+import socket
+import tempfile
+import time
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run_mode(mode, path, listen_port, smtp_port, es_url, args, conn):
+    # Runs in a separate process (as frosty would) so that its cpu and memory use are measured alone,
+    # the load (writer or logstash source) and the stand-ins run in the parent
+
+    logging.basicConfig(level=logging.WARNING)
+
+    import httpclient
+    httpclient.ELASTICSEARCH_URL = httpclient.KIBANA_URL = es_url
+
+    import mailer
+    import metrics
+    transport = mailer.Transport('127.0.0.1', smtp_port)
+
+    if mode == 'minimal':
+        import flowtable
+        import minimal
+        flows = flowtable.FlowTable(args.max_flows) if args.max_flows > 0 else None
+        producer = minimal.Parser(path, flows=flows)
+        notifier = minimal.Notifier(urgent_severity=0, transport=transport, flows=flows, window=args.window)
+        alert_queue, counter = minimal.alert_queue, 'frosty_parser_lines_read_total'
+
+    elif mode == 'elastic':
+        import elastic
+        producer = elastic.Listener(port=listen_port)
+        notifier = elastic.Notifier(urgent_severity=0, transport=transport, window=args.window)
+        alert_queue, counter = elastic.alert_queue, 'frosty_listener_lines_read_total'
+
+    else:
+        import elastic
+        import indexer
+        bulk = indexer.BulkWriter()
+        producer = indexer.Indexer(bulk, path)
+        notifier = elastic.Notifier(urgent_severity=0, transport=transport, window=args.window)
+        alert_queue, counter = elastic.alert_queue, 'frosty_indexer_lines_read_total'
+
+    producer.start()
+    notifier.start()
+    time.sleep(0.5)
+
+    began = time.monotonic()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    conn.send('ready')
+
+    # Until every line is read, or no more are for a few seconds (ie lines were lost)
+    read, progressed = 0, time.monotonic()
+    while read < args.lines and time.monotonic() - progressed < 5:
+        time.sleep(0.01)
+        if metrics.registry.totals()[counter] > read:
+            read, progressed = metrics.registry.totals()[counter], time.monotonic()
+    elapsed = (time.monotonic() if read >= args.lines else progressed) - began
+
+    # The remaining alerts are sent when stopping
+    if mode == 'elastic':
+        producer.stop()
+    else:
+        producer.stop = True
+    producer.join()
+    notifier.stop(); alert_queue.join(); notifier.join()
+
+    end = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = (end.ru_utime - usage.ru_utime) + (end.ru_stime - usage.ru_stime)
+    total = time.monotonic() - began
+
+    # End to end, ie eve timestamp to queued plus queued to accepted by the mail server
+    queued, mailed = metrics.queued_latency, metrics.mailed_latency
+    conn.send({
+        'lines': metrics.registry.totals()[counter],
+        'elapsed': elapsed,
+        'cpu': cpu / total,
+        'rss': end.ru_maxrss / 1024,
+        'latency': (queued.mean() or 0) + (mailed.mean() or 0),
+        'latency-p99': (queued.quantile(0.99) or 0) + (mailed.quantile(0.99) or 0)
+    })
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modes', nargs='+', default=['minimal', 'elastic', 'index'],
+                        choices=['minimal', 'elastic', 'index'])
+    parser.add_argument('--lines', '-n', type=int, default=200000)
+    parser.add_argument('--rate', '-r', type=int, default=None, help='lines per second (as fast as possible if unset)')
+    parser.add_argument('--alert-ratio', type=float, default=0.001)
+    parser.add_argument('--rotate-interval', type=float, default=5, help='seconds between eve.json rotations')
+    parser.add_argument('--rotate-lines', type=int, default=None, help='lines between eve.json rotations')
+    parser.add_argument('--alerts-only', action='store_true',
+                        help='elastic mode source sends only alerts (as logstash is configured to)')
+    parser.add_argument('--max-flows', type=int, default=0, help='minimal mode flow tracking (off by default as in frosty)')
+    parser.add_argument('--window', type=float, default=1, help='seconds between alert mails')
+    parser.add_argument('--sensors', type=int, default=1,
+                        help='eve.json files (one per sensor directory) followed by minimal and index modes')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    context = multiprocessing.get_context('spawn')
+
+    print(f'{"mode":>8} {"lines/sec":>10} {"cpu":>6} {"peak rss":>9} {"latency":>8} {"p99 <=":>7} {"mails":>6} '
+          f'{"rotations":>9}')
+    for mode in args.modes:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # Several sensors are followed through a glob, each writing its share of the lines
+            paths = [os.path.join(tmpdir, 'eve.json')]
+            if args.sensors > 1:
+                paths = [os.path.join(tmpdir, f'sensor{i}', 'eve.json') for i in range(args.sensors)]
+            for p in paths:
+                os.makedirs(os.path.dirname(p), exist_ok=True)
+                open(p, 'w').close()
+            path = paths[0] if len(paths) == 1 else os.path.join(tmpdir, 'sensor*', 'eve.json')
+
+            smtp = stubs.SMTPServer().start()
+            es = stubs.ElasticsearchServer().start()
+            port = free_port()
+
+            conn, child_conn = context.Pipe()
+            child = context.Process(target=run_mode, args=(mode, path, port, smtp.port, es.url, args, child_conn))
+            child.start()
+            conn.recv()
+
+            kwargs = {'alert_ratio': args.alert_ratio}
+            if mode == 'elastic':
+                sources = [synthetic.LogstashSource(port, args.lines, rate=args.rate, alerts_only=args.alerts_only,
+                                                    **kwargs)]
+            else:
+                rate = args.rate / len(paths) if args.rate is not None else None
+                sources = [synthetic.Writer(p, args.lines // len(paths) + (i < args.lines % len(paths)), rate=rate,
+                                            rotate_interval=args.rotate_interval, rotate_lines=args.rotate_lines,
+                                            **kwargs)
+                           for i, p in enumerate(paths)]
+            for source in sources:
+                source.start()
+
+            result = conn.recv()
+            for source in sources:
+                source.join()
+            child.join()
+            smtp.stop()
+            es.stop()
+
+            print(f"{mode:>8} {result['lines'] / result['elapsed']:10.0f} {result['cpu'] * 100:5.0f}% "
+                  f"{result['rss']:7.1f}MB {result['latency']:7.2f}s {result['latency-p99']:6.1f}s "
+                  f"{len(smtp.messages):6d} {sum([s.rotations for s in sources if hasattr(s, 'rotations')]):9d}")
+
+            # Eg lines of rotated files missed
+            assert result['lines'] == args.lines, f"{args.lines - result['lines']} lines lost"
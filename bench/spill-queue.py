@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import journal
+
+import argparse
+import json
+import tempfile
+import threading
+import time
+
+
+def run(q, count, record):
+    # One producer and one consumer acknowledging every 1000 items (ie a sent mail)
+
+    def consume():
+        for i in range(count):
+            q.get()
+            q.task_done()
+            if i % 1000 == 999:
+                q.ack()
+        q.ack()
+
+    consumer = threading.Thread(target=consume)
+
+    start = time.perf_counter()
+    consumer.start()
+    for _ in range(count):
+        q.put(record)
+    consumer.join()
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', '-n', type=int, default=200000)
+    args = parser.parse_args()
+
+    record = {
+        'timestamp': '2021-02-20T21:21:06.695534-0500',
+        'flow_id': 1700754495777475,
+        'event_type': 'alert',
+        'src_ip': '101.99.95.201',
+        'dest_ip': '192.168.1.65',
+        'alert': {'signature_id': 2520000, 'signature': 'ET TOR Known Tor Exit Node Traffic group 1', 'severity': 2}
+    }
+    dumps = lambda r: json.dumps(r, separators=(',', ':')).encode()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, maxsize in [('in-memory', args.count), ('spilled', 100)]:
+            q = journal.SpillQueue(maxsize=maxsize, dumps=dumps, loads=json.loads)
+            q.open(os.path.join(tmpdir, f'{name}.journal'))
+
+            elapsed = run(q, args.count, record)
+            print(f'{name:>10}: {args.count / elapsed:10.0f} alerts/sec {dict(q.stats)}')
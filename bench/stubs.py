@@ -0,0 +1,572 @@
+import collections
+import datetime
+import functools
+import gzip
+import http.server
+import json
+import random
+import socketserver
+import threading
+import urllib.parse
+
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    # Local stand-in for an MTA, accepted messages are kept in messages, the first fail_count
+    # transactions are rejected with a transient error and drop_after closes sessions after that many messages
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, fail_count=0, drop_after=None):
+        socketserver.ThreadingTCPServer.__init__(self, (host, port), SMTPHandler)
+        self.port = self.server_address[1]
+
+        self.fail_count = fail_count
+        self.drop_after = drop_after
+
+        self.lock = threading.Lock()
+        self.messages = []
+        self.sessions = 0
+        self.failures = 0
+
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name='SMTPServer', daemon=True)
+        thread.start()
+        return self
+
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.sessions += 1
+
+        self.reply('220 localhost stub')
+        sent = 0
+        sender, recipients = None, []
+
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors='replace').strip()
+            verb = command[:4].upper()
+
+            if verb in ['EHLO', 'HELO']:
+                self.reply('250-localhost\r\n250-SIZE 52428800\r\n250 8BITMIME' if verb == 'EHLO' else '250 localhost')
+            elif verb == 'MAIL':
+                sender, recipients = command[10:].strip(), []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                recipients += [command[8:].strip()]
+                self.reply('250 Accepted')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                while True:
+                    line = self.rfile.readline()
+                    if not line or line == b'.\r\n':
+                        break
+                    data += [line[1:] if line.startswith(b'..') else line]
+
+                with server.lock:
+                    if server.failures < server.fail_count:
+                        server.failures += 1
+                        self.reply('451 Temporary failure')
+                        continue
+                    server.messages += [(sender, recipients, b''.join(data))]
+
+                self.reply('250 OK queued')
+                sent += 1
+                if server.drop_after is not None and sent >= server.drop_after:
+                    return
+            elif verb == 'RSET':
+                sender, recipients = None, []
+                self.reply('250 OK')
+            elif verb == 'NOOP':
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class ElasticsearchServer(http.server.ThreadingHTTPServer):
+    # Local stand-in for the _bulk api, document counts per index are kept in indices (and the documents
+    # themselves in documents if keep), the first fail_count requests are rejected with a 429 and
+    # reject_ratio of the documents after that are rejected individually (as when the write queues are full).
+    # Also answers the Kibana index pattern lookup (ie serves as both KIBANA_URL and ELASTICSEARCH_URL) and
+    # searches (with points in time, response filtering and composite aggregations, see search()) over the
+    # documents given to load().
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, fail_count=0, reject_ratio=0.0, keep=False):
+        http.server.ThreadingHTTPServer.__init__(self, (host, port), ElasticsearchHandler)
+        self.port = self.server_address[1]
+        self.url = f'http://{host}:{self.port}'
+
+        self.fail_count = fail_count
+        self.reject_ratio = reject_ratio
+        self.keep = keep
+
+        self.lock = threading.Lock()
+        self.indices = collections.defaultdict(int)
+        self.documents = []
+        self.requests = 0
+        self.failures = 0
+        self.rejected = 0
+
+        # Searchable documents per index (with their _id and a sequence number serving as the _shard_doc
+        # tiebreaker), the points in time (the indices they cover) and the search requests by kind
+        self.searchable = collections.defaultdict(list)
+        self.loaded = 0
+        self.cache = {}
+        self.pits = {}
+        self.searches = collections.Counter()
+
+
+    def load(self, index, documents):
+        with self.lock:
+            for document in documents:
+                seq = self.loaded
+                self.loaded += 1
+                self.searchable[index] += [(f'{index}-{len(self.searchable[index])}', seq, document)]
+            self.cache.clear()
+
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name='ElasticsearchServer', daemon=True)
+        thread.start()
+        return self
+
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class ElasticsearchHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+    def do_GET(self):
+        if self.path.startswith('/api/saved_objects/_find'):
+            self.reply(200, {'saved_objects': [{'id': 'stub-index-pattern', 'attributes': {'title': 'suricata-*'}}]})
+            return
+        self.reply(200, {'name': 'stub', 'version': {'number': '7.10.2'}})
+
+
+    def body(self):
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            data = gzip.decompress(data)
+        return data
+
+
+    def do_DELETE(self):
+        body = json.loads(self.body() or b'{}')
+        if self.path.split('?')[0] != '/_pit':
+            self.reply(404, {'error': 'not found', 'status': 404})
+            return
+
+        with self.server.lock:
+            found = self.server.pits.pop(body.get('id'), None) is not None
+        self.reply(200 if found else 404, {'succeeded': found, 'num_freed': int(found)})
+
+
+    def do_POST(self):
+        data = self.body()
+        url = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+
+        if url.path.endswith('/_pit'):
+            with self.server.lock:
+                pit_id = f'pit-{len(self.server.pits)}-{random.randrange(1 << 32)}'
+                self.server.pits[pit_id] = url.path[1:-len('/_pit')].split(',')
+                self.server.searches['pit'] += 1
+            self.reply(200, {'id': pit_id})
+            return
+
+        if url.path.endswith('/_search'):
+            body = json.loads(data or b'{}')
+            pit_id = body.get('pit', {}).get('id')
+            with self.server.lock:
+                if pit_id is not None and pit_id not in self.server.pits:
+                    self.reply(404, {'error': {'type': 'search_context_missing_exception'}, 'status': 404})
+                    return
+                names = self.server.pits[pit_id] if pit_id is not None else url.path[1:-len('/_search')].split(',')
+                documents = [d for n in names for d in self.server.searchable.get(n, [])]
+                cache = self.server.cache.setdefault(','.join(names), {})
+
+            try:
+                result = search(documents, body, self.server.searches, pit=pit_id is not None, cache=cache)
+            except ValueError as e:
+                self.reply(400, {'error': {'type': 'illegal_argument_exception', 'reason': str(e)}, 'status': 400})
+                return
+            if pit_id is not None:
+                result['pit_id'] = pit_id
+
+            self.reply(200, filter_response(result, params.get('filter_path')))
+            return
+
+        if url.path != '/_bulk':
+            self.reply(404, {'error': 'not found', 'status': 404})
+            return
+
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            if server.failures < server.fail_count:
+                server.failures += 1
+                self.reply(429, {'error': {'type': 'es_rejected_execution_exception'}, 'status': 429})
+                return
+
+        lines = data.split(b'\n')
+        items, errors = [], False
+        with server.lock:
+            for action, document in zip(lines[0::2], lines[1::2]):
+                index = json.loads(action)['index']['_index']
+                if random.random() < server.reject_ratio:
+                    items += [{'index': {'status': 429, 'error': {'type': 'es_rejected_execution_exception'}}}]
+                    server.rejected += 1
+                    errors = True
+                    continue
+
+                server.indices[index] += 1
+                if server.keep:
+                    server.documents += [json.loads(document)]
+                items += [{'index': {'status': 201}}]
+
+        self.reply(200, {'errors': errors, 'items': items})
+
+
+def field(document, name):
+    # Value of a dotted field (None if absent), the keyword subfield of strings is as the default dynamic mapping
+
+    if name.endswith('.keyword'):
+        value = field(document, name[:-len('.keyword')])
+        return value if isinstance(value, str) else None
+
+    value = document
+    for part in name.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def timestamp(value, time_zone=None):
+    # Dates given without an offset are in time_zone (UTC by default)
+
+    if value == 'now':
+        return datetime.datetime.now(datetime.timezone.utc)
+    return parse_timestamp(value, time_zone)
+
+
+@functools.lru_cache(maxsize=None)
+def parse_timestamp(value, time_zone):
+    when = datetime.datetime.fromisoformat(value)
+    if when.tzinfo is None:
+        offset = datetime.datetime.strptime(time_zone, '%z').tzinfo if time_zone is not None else datetime.timezone.utc
+        when = when.replace(tzinfo=offset)
+    return when
+
+
+def predicate(query):
+    # Function matching the documents of the query clauses used by frosty (and its crons), anything else
+    # is rejected
+
+    kind, clause = next(iter(query.items()))
+
+    if kind == 'match_all':
+        return lambda document: True
+
+    if kind == 'bool':
+        for occur in clause:
+            if occur not in ['must', 'filter']:
+                raise ValueError(f'unsupported bool clause {occur}')
+        clauses = []
+        for occur in ['must', 'filter']:
+            c = clause.get(occur, [])
+            clauses += c if isinstance(c, list) else [c]
+        predicates = [predicate(c) for c in clauses]
+        return lambda document: all(p(document) for p in predicates)
+
+    if kind == 'exists':
+        return lambda document: field(document, clause['field']) is not None
+
+    if kind in ['match', 'term']:
+        name, value = next(iter(clause.items()))
+        if isinstance(value, dict):
+            value = value.get('query', value.get('value'))
+        return lambda document: field(document, name) == value
+
+    if kind == 'terms':
+        name, values = next(iter(clause.items()))
+        values = set(values)
+        return lambda document: field(document, name) in values
+
+    if kind == 'range':
+        name, bounds = next(iter(clause.items()))
+        compare = {'gte': lambda v, b: v >= b, 'gt': lambda v, b: v > b, 'lte': lambda v, b: v <= b, 'lt': lambda v, b: v < b}
+        dates = [(compare[k], timestamp(b, bounds.get('time_zone')) if isinstance(b, str) else b)
+                 for k, b in bounds.items() if k != 'time_zone']
+        numbers = [(compare[k], b) for k, b in bounds.items() if k != 'time_zone']
+
+        def matches(document):
+            value = field(document, name)
+            if value is None:
+                return False
+            if isinstance(value, str):
+                value = timestamp(value)
+                return all(c(value, b) for c, b in dates)
+            return all(c(value, b) for c, b in numbers)
+        return matches
+
+    raise ValueError(f'unsupported query {kind}')
+
+
+def sort_value(entry, name):
+    _id, seq, document = entry
+    if name == '_id':
+        return _id
+    if name == '_shard_doc':
+        return seq
+
+    value = field(document, name)
+    if isinstance(value, str) and name == 'timestamp':
+        return int(timestamp(value).timestamp() * 1000)
+    return value
+
+
+def search(entries, body, counter, pit=False, cache=None):
+    # Hits (sorted, paginated with search_after, collapsed and with _source filtered) or composite aggregation
+    # buckets (paginated with after) of the matching documents, those matching a query are kept in cache
+    # (if given) for its next pages
+
+    query = body.get('query', {'match_all': {}})
+    key = json.dumps(query, sort_keys=True)
+    if cache is not None and key in cache:
+        entries = cache[key]
+    else:
+        matches = predicate(query)
+        entries = [e for e in entries if matches(e[2])]
+        if cache is not None:
+            cache[key] = entries
+
+    aggregations = {}
+    for name, agg in body.get('aggs', {}).items():
+        if 'composite' not in agg:
+            raise ValueError('unsupported aggregation')
+        aggregations[name] = composite(entries, agg['composite'])
+        counter['composite-pages-after' if 'after' in agg['composite'] else 'composite'] += 1
+
+    # Ascending sorts only, a point in time adds the _shard_doc tiebreaker
+    sort = []
+    for s in body.get('sort', []):
+        if isinstance(s, dict) and next(iter(s.values())) not in ['asc', {'order': 'asc'}]:
+            raise ValueError('unsupported sort order')
+        sort += [next(iter(s.keys())) if isinstance(s, dict) else s]
+    if pit:
+        sort += ['_shard_doc']
+
+    if len(sort) > 0:
+        hits = sorted([([sort_value(e, s) for s in sort], e) for e in entries], key=lambda k: k[0])
+        if 'search_after' in body:
+            hits = [h for h in hits if h[0] > list(body['search_after'])]
+            counter['search-pages-after'] += 1
+    else:
+        hits = [(None, e) for e in entries]
+
+    if 'collapse' in body:
+        seen, collapsed = set(), []
+        for key, e in hits:
+            value = field(e[2], body['collapse']['field'])
+            if value not in seen:
+                seen.add(value)
+                collapsed += [(key, e)]
+        hits = collapsed
+        counter['collapsed'] += 1
+
+    counter['search'] += 1
+
+    def source(document):
+        includes = body.get('_source', True)
+        if includes is True:
+            return document
+        if includes is False:
+            return {}
+        return filter_response(document, ','.join(includes))
+
+    result = {'took': 1, 'timed_out': False, 'hits': {'hits': []}}
+    for key, (_id, seq, document) in hits[:body.get('size', 10)]:
+        hit = {'_index': _id.rsplit('-', 1)[0], '_id': _id, '_source': source(document)}
+        if key is not None:
+            hit['sort'] = key
+        result['hits']['hits'] += [hit]
+    if len(aggregations) > 0:
+        result['aggregations'] = aggregations
+    return result
+
+
+def composite(entries, agg):
+    # Buckets of the distinct source values in key order (documents missing a value are not bucketed),
+    # terms on a text field (rather than its keyword subfield) fail as they would without fielddata
+
+    names = [next(iter(s.keys())) for s in agg['sources']]
+    fields = [next(iter(s.values()))['terms']['field'] for s in agg['sources']]
+
+    counts = collections.Counter()
+    for _, _, document in entries:
+        key = tuple([field(document, f) for f in fields])
+        if any([isinstance(v, str) and not f.endswith('.keyword') for v, f in zip(key, fields)]):
+            raise ValueError('text fields are not optimised for operations that require per-document field data')
+        if None not in key:
+            counts[key] += 1
+
+    keys = sorted(counts.keys())
+    if 'after' in agg:
+        after = tuple([agg['after'][n] for n in names])
+        keys = [k for k in keys if k > after]
+    keys = keys[:agg.get('size', 10)]
+
+    result = {'buckets': [{'key': dict(zip(names, k)), 'doc_count': counts[k]} for k in keys]}
+    if len(keys) > 0:
+        result['after_key'] = dict(zip(names, keys[-1]))
+    return result
+
+
+def filter_response(value, filter_path):
+    # Response filtering, ie only the given (comma separated) dotted paths are kept
+
+    if filter_path is None:
+        return value
+
+    tree = {}
+    for path in filter_path.split(','):
+        node = tree
+        for part in path.split('.'):
+            node = node.setdefault(part, {})
+
+    def apply(value, node):
+        if len(node) == 0:
+            return value
+        if isinstance(value, list):
+            kept = [apply(v, node) for v in value]
+            kept = [v for v in kept if v is not None]
+            return kept if len(kept) > 0 else None
+        if isinstance(value, dict):
+            kept = {k: apply(value[k], node[k]) for k in node if k in value}
+            kept = {k: v for k, v in kept.items() if v is not None}
+            return kept if len(kept) > 0 else None
+        return None
+
+    filtered = apply(value, tree)
+    return filtered if filtered is not None else {}
+
+
+class HTTPStatsFixture:
+    # Fixed (seeded) http and tls events and flow records over the given days, indexed as index mode does
+    # (daily indices by UTC date) for the http-stats cron's searches.  Some flows span midnight, some http
+    # events lack a hostname, some flows have no flow record (ie count as zero bytes) and some flow records
+    # are duplicated (as index mode reindexes after a restart, enough to fill the lookups' pages).
+
+    TIME_ZONE = datetime.timezone(datetime.timedelta(hours=-5))
+
+    def __init__(self, days, flows=20000, hostnames=50, seed=1):
+        rand = random.Random(seed)
+
+        self.events = []
+        self.bytes = {}
+        self.documents = collections.defaultdict(list)
+
+        for flow_id in range(1, flows + 1):
+            event_type = rand.choice(['http', 'tls'])
+            hostname = f'host{rand.randrange(hostnames)}.example.com'
+            day = datetime.datetime.combine(rand.choice(days), datetime.time(), tzinfo=self.TIME_ZONE)
+
+            # About one in ten starting shortly before midnight (and so likely to continue past it)
+            when = day + datetime.timedelta(seconds=rand.randrange(86400 - 900, 86400) if rand.random() < 0.1 else
+                                                    rand.randrange(86400 - 900))
+
+            for i in range(rand.randint(1, 4)):
+                document = {'timestamp': self.format(when), 'event_type': event_type, 'flow_id': flow_id}
+                if event_type == 'tls':
+                    document['tls'] = {'sni': hostname}
+                elif rand.random() < 0.95:
+                    document['http'] = {'hostname': hostname}
+                else:
+                    document['http'] = {}
+                self.events += [(when, document)]
+                self.index(when, document)
+                when += datetime.timedelta(seconds=rand.randrange(1, 300))
+
+            if rand.random() < 0.9:
+                self.bytes[flow_id] = rand.randrange(1 << 30)
+                when += datetime.timedelta(seconds=30)
+                record = {'timestamp': self.format(when), 'event_type': 'flow',
+                          'flow_id': flow_id, 'flow': {'bytes_toclient': self.bytes[flow_id] // 3,
+                                                       'bytes_toserver': self.bytes[flow_id] - self.bytes[flow_id] // 3}}
+                for _ in range(2 if rand.random() < 0.2 else 1):
+                    self.index(when, record)
+
+
+    @staticmethod
+    def format(when):
+        return when.strftime('%Y-%m-%dT%H:%M:%S.%f%z')
+
+
+    def index(self, when, document):
+        self.documents[when.astimezone(datetime.timezone.utc).strftime('suricata-%Y%m%d')] += [document]
+
+
+    def load(self, server):
+        for index, documents in self.documents.items():
+            server.load(index, documents)
+        return server
+
+
+    def totals(self, start, end):
+        # Connections and bandwidth per hostname of the flows with events in [start, end) (naive, in TIME_ZONE),
+        # each flow counted once
+        start, end = start.replace(tzinfo=self.TIME_ZONE), end.replace(tzinfo=self.TIME_ZONE)
+
+        totals = {}
+        for event_type, (section, key) in [('http', ('http', 'hostname')), ('tls', ('tls', 'sni'))]:
+            hostnames = {}
+            for when, document in self.events:
+                if document['event_type'] == event_type and start <= when < end and key in document[section]:
+                    hostnames[document['flow_id']] = document[section][key]
+
+            by_count, by_bandwidth = collections.defaultdict(int), collections.defaultdict(int)
+            for flow_id, hostname in hostnames.items():
+                by_count[hostname] += 1
+                by_bandwidth[hostname] += self.bytes.get(flow_id, 0)
+            totals[event_type] = (by_count, by_bandwidth)
+        return totals
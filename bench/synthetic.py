@@ -0,0 +1,170 @@
+import datetime
+import json
+import os
+import random
+import socket
+import threading
+import time
+
+
+# Rough approximation of a typical event type mix (alerts are added at the given ratio)
+EVENT_TYPES = ['flow'] * 40 + ['dns'] * 30 + ['http'] * 10 + ['tls'] * 15 + ['fileinfo'] * 4 + ['stats']
+
+SIGNATURES = [
+    (2520000, 'ET TOR Known Tor Exit Node Traffic group 1', 2),
+    (2013028, 'ET POLICY curl User-Agent Outbound', 3),
+    (2027695, 'ET INFO Observed DNS Query to .cloud TLD', 3),
+    (2024897, 'ET USER_AGENTS Go HTTP Client User-Agent', 3),
+    (2200075, 'SURICATA UDPv4 invalid checksum', 3),
+    (2402000, 'ET DROP Dshield Block Listed Source group 1', 2),
+    (2010935, 'ET POLICY Suspicious inbound to MSSQL port 1433', 2),
+    (2001219, 'ET SCAN Potential SSH Scan', 1)
+]
+
+# Fixed width stand-in replaced by the time of writing (ie the eve timestamp)
+PLACEHOLDER = '0000-00-00T00:00:00.000000+0000'
+
+
+def timestamp(t):
+    # As suricata writes them, eg 2021-02-20T21:21:06.695534-0500
+    return datetime.datetime.fromtimestamp(t).astimezone().strftime('%Y-%m-%dT%H:%M:%S.%f%z')
+
+
+def record(event_type, flows=100000, when=PLACEHOLDER):
+    # A record carrying the fields tracked by the flow table and looked at by the notifiers
+    hostname = f'host{random.randrange(1000)}.example.com'
+    sid, signature, severity = random.choice(SIGNATURES)
+
+    details = {
+        'alert': {'action': 'allowed', 'gid': 1, 'signature_id': sid, 'rev': 1, 'signature': signature,
+                  'category': 'Misc Attack', 'severity': severity},
+        'flow': {'pkts_toserver': 10, 'pkts_toclient': 12, 'bytes_toserver': random.randrange(1 << 20),
+                 'bytes_toclient': random.randrange(1 << 24), 'start': when, 'end': when, 'age': 30,
+                 'state': 'closed', 'alerted': random.random() < 0.01},
+        'http': {'hostname': hostname, 'url': '/', 'http_user_agent': 'x' * random.randrange(20, 200)},
+        'tls': {'subject': 'CN=' + hostname, 'sni': hostname, 'version': 'TLS 1.2'},
+        'dns': {'type': 'query', 'id': 1, 'rrname': hostname, 'rrtype': 'A', 'tx_id': 0}
+    }
+
+    result = {
+        'timestamp': when,
+        'flow_id': random.randrange(flows),
+        'in_iface': 'wlp1s0',
+        'event_type': event_type,
+        'src_ip': f'192.168.1.{random.randrange(2, 255)}',
+        'src_port': random.randrange(1024, 65536),
+        'dest_ip': f'101.99.95.{random.randrange(1, 255)}',
+        'dest_port': 443,
+        'proto': 'TCP',
+        event_type: details.get(event_type, {'detail': 'x' * random.randrange(20, 400)})
+    }
+    if event_type == 'flow':
+        result['app_proto'] = random.choice(['http', 'tls', 'dns', 'failed'])
+    if event_type == 'alert':
+        result['flow'] = {'start': when}
+    return result
+
+
+def lines(count, alert_ratio=0.001, flows=100000, when=PLACEHOLDER):
+    for _ in range(count):
+        event_type = 'alert' if random.random() < alert_ratio else random.choice(EVENT_TYPES)
+        yield (json.dumps(record(event_type, flows, when), separators=(',', ':')) + '\n').encode()
+
+
+def generate(path, count, alert_ratio=0.001, flows=100000, start=None, spread=0):
+    # Synthetic eve.json with timestamps spread evenly over spread seconds from start (now by default)
+    start = time.time() if start is None else start
+    with open(path, 'wb') as file:
+        for i, line in enumerate(lines(count, alert_ratio, flows)):
+            file.write(line.replace(PLACEHOLDER.encode(), timestamp(start + spread * i / count).encode()))
+
+
+class Source(threading.Thread):
+    def __init__(self, count, rate=None, alert_ratio=0.001, flows=100000, alerts_only=False, chunk=1000, pool=10000):
+        # Sends count lines in chunks, at rate lines per second (as fast as possible if None), timestamped
+        # as they are sent.  Lines are drawn from a pregenerated pool so that generating them costs little.
+
+        threading.Thread.__init__(self)
+        self.daemon = False
+
+        self.count = count
+        self.rate = rate
+        self.chunk = chunk
+
+        generated = lines(pool, 1.0 if alerts_only else alert_ratio, flows)
+        self.__pool = list(generated)
+        self.alerts = 0
+        self.sent = 0
+
+
+    def chunks(self):
+        start = time.monotonic()
+        i = 0
+        while self.sent < self.count:
+            n = min(self.chunk, self.count - self.sent)
+            selected = [self.__pool[(i + k) % len(self.__pool)] for k in range(n)]
+            i += n
+
+            data = b''.join(selected).replace(PLACEHOLDER.encode(), timestamp(time.time()).encode())
+            self.alerts += data.count(b'"event_type":"alert"')
+            yield data, n
+            self.sent += n
+
+            if self.rate is not None:
+                delay = start + self.sent / self.rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+
+class Writer(Source):
+    def __init__(self, path, count, rotate_interval=None, rotate_lines=None, **kwargs):
+        # Appends to path as suricata does, rotating it (renamed to path.1, path.2, ... and a new file started,
+        # as logrotate with dateext does) every rotate_interval seconds and/or every rotate_lines lines (checked
+        # after each chunk).  Readers follow the renames and the new files from the directory events, including
+        # when more than a rotation behind (the rotated files are kept).
+
+        Source.__init__(self, count, **kwargs)
+        self.name = 'Writer'
+
+        self.path = path
+        self.rotate_interval = rotate_interval
+        self.rotate_lines = rotate_lines
+        self.rotations = 0
+
+
+    def run(self):
+        file = open(self.path, 'ab')
+        rotated, written = time.monotonic(), 0
+
+        for data, n in self.chunks():
+            file.write(data)
+            file.flush()
+            written += n
+
+            if (self.rotate_interval is not None and time.monotonic() - rotated >= self.rotate_interval) or \
+               (self.rotate_lines is not None and written >= self.rotate_lines):
+                file.close()
+                os.replace(self.path, f'{self.path}.{self.rotations + 1}')
+                file = open(self.path, 'ab')
+                rotated, written = time.monotonic(), 0
+                self.rotations += 1
+
+        file.close()
+
+
+class LogstashSource(Source):
+    def __init__(self, port, count, host='127.0.0.1', **kwargs):
+        # A logstash tcp output (json_lines codec), with alerts_only as the frosty pipeline configures it
+
+        Source.__init__(self, count, **kwargs)
+        self.name = 'LogstashSource'
+
+        self.host = host
+        self.port = port
+
+
+    def run(self):
+        sock = socket.create_connection((self.host, self.port))
+        for data, _ in self.chunks():
+            sock.sendall(data)
+        sock.close()
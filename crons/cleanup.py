@@ -1,18 +1,171 @@
 #!/usr/bin/env python3
 
-import requests
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import httpclient
+
+import argparse
+import concurrent.futures
 import datetime
+import logging
+import re
+from typing import Dict, List, Tuple, Union
 
 
-if __name__ == '__main__':
-    resp = requests.get('http://127.0.0.1:9200/_cat/indices/suricata-*?format=json', timeout=100)
+def parse_size(size: str) -> int:
+    # Eg 500mb or 50gb (as in _cat/indices), plain numbers are bytes
+    m = re.fullmatch(r'(\d+(?:\.\d+)?)\s*(b|kb|mb|gb|tb)?', size.strip().lower())
+    if m is None:
+        raise argparse.ArgumentTypeError(f'invalid size {size}')
+    units = {None: 1, 'b': 1, 'kb': 1024, 'mb': 1024**2, 'gb': 1024**3, 'tb': 1024**4}
+    return int(float(m.group(1)) * units[m.group(2)])
+
+
+def indices() -> List[Dict[str, Union[str, int, datetime.date, bool]]]:
+    # The daily indices, oldest first, with their store sizes and whether already merged (a single segment
+    # per shard copy) and made read-only
+
+    es = httpclient.elasticsearch()
+
+    resp = es.get('/_cat/indices/suricata-*', params={'format':'json', 'bytes':'b',
+                                                      'h':'index,store.size,pri,rep,segments.count'})
     resp.raise_for_status()
-    indices = [index['index'] for index in resp.json()]
 
-    date = int((datetime.date.today() - datetime.timedelta(days=90)).strftime('%Y%m%d'))
-    indices_delete = [index for index in indices if int(index.split('-', maxsplit=1)[1]) < date]
+    resp2 = es.get('/suricata-*/_settings/index.blocks.write', params={'flat_settings':'true'})
+    resp2.raise_for_status()
+    settings = resp2.json()
+
+    result = []
+    for index in resp.json():
+        try:
+            date = datetime.datetime.strptime(index['index'].split('-', maxsplit=1)[1], '%Y%m%d').date()
+        except ValueError:
+            logging.warning('ignoring index %s', index['index'])
+            continue
+
+        shards = int(index['pri'] or 1) * (1 + int(index['rep'] or 0))
+
+        result += [{
+            'index': index['index'],
+            'date': date,
+            'size': int(index['store.size'] or 0),
+            'merged': int(index['segments.count'] or 0) <= shards,
+            'read_only': settings.get(index['index'], {}).get('settings', {}).get('index.blocks.write') == 'true'
+        }]
+
+    return sorted(result, key=lambda i: i['date'])
+
+
+def plan(
+        indices: List[Dict[str, Union[str, int, datetime.date, bool]]],
+        max_age: int,
+       max_size: Union[int, None],
+    merge_after: int,
+    block_after: int,
+          today: datetime.date = datetime.date.today()
+) -> List[Tuple[Dict[str, Union[str, int, datetime.date, bool]], str]]:
+
+    # Action (and reason) for each index: delete those older than max_age days, then the oldest
+    # until the total size is within max_size (never the current day's), force merge those older than
+    # merge_after days (ie no longer written to), make read-only those older than block_after days
+    # and keep the rest.
+    #
+    # Index mode writes late records (eg catching up after an outage) to the index of their date, writes
+    # to a read-only index are rejected hence block_after should be beyond any backfill.  Late records
+    # written to a merged index add segments, it is merged again by the next run.
+
+    actions = []
+    total = sum([i['size'] for i in indices])
+
+    for index in indices:
+        age = (today - index['date']).days
+
+        if age > max_age:
+            actions += [(index, 'delete (age)')]
+            total -= index['size']
+        elif max_size is not None and total > max_size and age > 0:
+            actions += [(index, 'delete (size)')]
+            total -= index['size']
+        elif age > merge_after and not index['merged'] and not index['read_only']:
+            actions += [(index, 'merge and block' if age > block_after else 'merge')]
+        elif age > block_after and not index['read_only']:
+            actions += [(index, 'block')]
+        else:
+            actions += [(index, 'keep')]
+
+    return actions
+
+
+def delete(names: List[str], batch_size: int = 20, workers: int = 4) -> None:
+    # Several indices per request (bounded by the url length) with a few requests in flight
+
+    es = httpclient.elasticsearch()
 
-    for index in indices_delete:
-        resp = requests.delete(f'http://127.0.0.1:9200/{index}')
+    def delete_batch(batch):
+        resp = es.delete('/' + ','.join(batch))
         resp.raise_for_status()
+        logging.info('deleted %s', ', '.join(batch))
+
+    batches = [names[i:i+batch_size] for i in range(0, len(names), batch_size)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for future in [executor.submit(delete_batch, batch) for batch in batches]:
+            future.result()
+
+
+def merge(name: str) -> None:
+    # Single segment per shard, merges are run one at a time (they are throttled by Elasticsearch
+    # regardless) and can take a while
+
+    es = httpclient.elasticsearch()
+
+    resp = es.post(f'/{name}/_forcemerge', params={'max_num_segments':'1'}, timeout=3600)
+    resp.raise_for_status()
+
+    logging.info('merged %s', name)
+
+
+def block(name: str) -> None:
+    es = httpclient.elasticsearch()
+
+    resp = es.put(f'/{name}/_settings', json_body={'index.blocks.write': True})
+    resp.raise_for_status()
+
+    logging.info('made read-only %s', name)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--max-age', type=int, default=90, help='days to keep indices')
+    parser.add_argument('--max-size', type=parse_size, default=None,
+                        help='total store size to keep indices within (eg 50gb), the oldest are deleted first')
+    parser.add_argument('--merge-after', type=int, default=1,
+                        help='days after which indices are force merged')
+    parser.add_argument('--block-after', type=int, default=30,
+                        help='days after which indices are made read-only (beyond any index mode backfill)')
+    parser.add_argument('--dry-run', '-n', action='store_true', help='only report what would be done')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(levelname)s:%(filename)s:%(lineno)d:%(message)s')
+
+    actions = plan(indices(), args.max_age, args.max_size, args.merge_after, args.block_after)
+
+    if args.dry_run:
+        kept = 0
+        for index, action in actions:
+            print(f"{index['index']:<20} {index['size']:>16} {action}")
+            if not action.startswith('delete'):
+                kept += index['size']
+        print(f"{len([a for _, a in actions if a.startswith('delete')])} indices to delete, "
+              f"{len([a for _, a in actions if 'merge' in a])} to merge, "
+              f"{len([a for _, a in actions if 'block' in a])} to make read-only, {kept} bytes kept")
+        sys.exit(0)
+
+    delete([index['index'] for index, action in actions if action.startswith('delete')])
+
+    for index, action in actions:
+        if 'merge' in action:
+            merge(index['index'])
+        if 'block' in action:
+            block(index['index'])
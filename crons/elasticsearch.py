@@ -1,114 +1,239 @@
-import requests
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import httpclient
+
+import collections
+import concurrent.futures
 import datetime
 import logging
-from typing import Dict, Iterator, List, Union
+import threading
+from typing import Dict, Iterable, Iterator, List, Union
 
 
-def search(
-    query: Dict[str, Union[Dict, List, int]],
+def indices(
     start: datetime.datetime,
       end: datetime.datetime = datetime.datetime.now()
-) -> Iterator[Dict[str, Union[Dict, List, int, str]]]:
-
-    # Ref: https://www.elastic.co/guide/en/elasticsearch/reference/current/paginate-search-results.html#search-after
-    #      https://www.elastic.co/guide/en/elasticsearch/reference/current/search-search.html
+) -> str:
 
+    # Daily indices covering the range, for use with ignore_unavailable rather than checking each exists
     dates = [(start + datetime.timedelta(days=i)).date() for i in range((end-start).days + 2)]
-    indices = [d.strftime('suricata-%Y%m%d') for d in dates]
+    return ','.join([d.strftime('suricata-%Y%m%d') for d in dates])
+
+
+def search(
+          query: Dict[str, Union[Dict, List, int]],
+          start: datetime.datetime,
+            end: datetime.datetime = datetime.datetime.now(),
+         source: Union[List[str], bool, None] = None,
+    filter_path: Union[str, None] = 'pit_id,hits.hits._id,hits.hits._source,hits.hits.sort'
+) -> Iterator[Dict[str, Union[Dict, List, int, str]]]:
 
-    present = []
-    for index in indices:
-        resp = requests.get(f'http://127.0.0.1:9200/_cat/indices/{index}?format=json', timeout=100)
-        if resp.status_code == 200:
-            present += [index]
+    # Ref: https://www.elastic.co/guide/en/elasticsearch/reference/current/paginate-search-results.html#search-after
+    #      https://www.elastic.co/guide/en/elasticsearch/reference/current/point-in-time-api.html
+    #      https://www.elastic.co/guide/en/elasticsearch/reference/current/common-options.html#common-options-response-filtering
+
+    es = httpclient.elasticsearch()
+    names = indices(start, end)
+
+    # The query is not modified, source selects the fields returned (None for all of them)
+    query = dict(query)
+    query.pop('search_after', None)
+    query.setdefault('track_total_hits', False)
+    if source is not None:
+        query['_source'] = source
+
+    # The response filter has to retain pit_id and hits.hits.sort
+    params = {}
+    if filter_path is not None:
+        params['filter_path'] = filter_path
+
+    # Paginate within a point in time so that the pages are consistent,
+    # falling back to plain search_after on versions without it (< 7.10)
+    resp = es.post(f'/{names}/_pit', params={'keep_alive':'5m', 'ignore_unavailable':'true'})
+    if resp.status_code in [400, 404, 405]:
+        logging.warning('point in time unavailable (%d), paginating without it', resp.status_code)
+        pit_id = None
+    else:
+        resp.raise_for_status()
+        pit_id = resp.json()['id']
+
+    def fetch(search_after):
+        nonlocal pit_id
+
+        body = dict(query)
+        if search_after is not None:
+            body['search_after'] = search_after
+
+        if pit_id is not None:
+            body['pit'] = {'id': pit_id, 'keep_alive': '5m'}
+            resp = es.post('/_search', params=params, json_body=body)
+        else:
+            # Without the implicit point in time tiebreaker
+            body['sort'] = body.get('sort', []) + [{'_id': 'asc'}]
+            resp = es.post(f'/{names}/_search', params=dict(params, ignore_unavailable='true'), json_body=body)
+        resp.raise_for_status()
 
-    if len(present) < len(indices):
-        logging.warning('%d indices not present', len(indices) - len(present))
-    indices = present
+        result = resp.json()
+        pit_id = result.get('pit_id', pit_id)
+        return result.get('hits', {}).get('hits', [])
 
-    url = f'http://127.0.0.1:9200/{",".join(indices)}/_search'
+    # Fetch the next page in the background while the current one is processed
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
 
     count = 0
-    while True:
-        resp = requests.post(url, json=query, timeout=100)
-        resp.raise_for_status()
+    try:
+        future = executor.submit(fetch, None)
+        while True:
+            hits = future.result()
+            if len(hits) == 0:
+                break
 
-        hits = resp.json()['hits']['hits']
-        if len(hits) == 0:
-            break
+            future = executor.submit(fetch, hits[-1]['sort'])
 
-        for hit in hits:
-            yield hit
-            count += 1
+            for hit in hits:
+                yield hit
+                count += 1
 
-        lastsort = hits[-1]['sort']
-        query['search_after'] = lastsort
+    finally:
+        executor.shutdown(wait=True)
+        if pit_id is not None:
+            es.delete('/_pit', json_body={'id': pit_id})
 
     logging.info('%d records found', count)
 
 
-_flow_indices_cache = {}
+def composite(
+      query: Dict[str, Union[Dict, List, int]],
+    sources: List[Dict[str, Dict[str, str]]],
+      start: datetime.datetime,
+        end: datetime.datetime = datetime.datetime.now(),
+       size: int = 1000
+) -> Iterator[Dict[str, Union[Dict, int]]]:
+
+    # Ref: https://www.elastic.co/guide/en/elasticsearch/reference/current/search-aggregations-bucket-composite-aggregation.html
+
+    # Every bucket (ie distinct combination of the sources' values) of the documents matching the query
+    body = {
+        'size': 0,
+        'track_total_hits': False,
+        'query': query,
+        'aggs': {
+            'buckets': {
+                'composite': {
+                    'size': size,
+                    'sources': sources
+                }
+            }
+        }
+    }
 
-def flow(
-      flowid: int,
-       start: datetime.datetime,
-         end: datetime.datetime = datetime.datetime.now(),
-    timezone: str = '-05:00'
-) -> Union[Dict[str, Union[Dict, List, int, str]], None]:
+    es = httpclient.elasticsearch()
+    path = f'/{indices(start, end)}/_search'
+    params = {'ignore_unavailable':'true', 'filter_path':'aggregations.buckets.after_key,aggregations.buckets.buckets'}
 
-    dates = [(start + datetime.timedelta(days=i)).date() for i in range((end-start).days + 2)]
-    indices = [d.strftime('suricata-%Y%m%d') for d in dates]
+    count = 0
+    while True:
+        resp = es.post(path, params=params, json_body=body)
+        resp.raise_for_status()
 
-    global _flow_indices_cache
-    key = ','.join(indices)
-    if key in _flow_indices_cache:
-        indices = _flow_indices_cache[key]
-    else:
-        present = []
-        for index in indices:
-            resp = requests.get(f'http://127.0.0.1:9200/_cat/indices/{index}?format=json', timeout=100)
-            if resp.status_code == 200:
-                present += [index]
-
-        if len(present) < len(indices):
-            logging.warning('%d indices not present', len(indices) - len(present))
-        _flow_indices_cache[key] = indices = present
-
-    query = {
-        'query': {
-            'bool': {
-                'must': [
-                    {
-                        'match': {
-                            'event_type': 'flow'
-                        }
-                    },
-                    {
-                        'match': {
-                            'flow_id': flowid
-                        }
-                    },
-                    {
-                        'range': {
-                            'timestamp': {
-                                'gte': start.isoformat(),
-                                'lte': 'now',
-                                'time_zone': timezone
+        result = resp.json().get('aggregations', {}).get('buckets', {})
+        buckets = result.get('buckets', [])
+        for bucket in buckets:
+            yield bucket
+            count += 1
+
+        if len(buckets) == 0 or 'after_key' not in result:
+            break
+        body['aggs']['buckets']['composite']['after'] = result['after_key']
+
+    logging.info('%d buckets found', count)
+
+
+# Bounded least recently used cache of flow_id to total bytes (ie bytes_toclient + bytes_toserver)
+_flow_bytes_cache = collections.OrderedDict()
+_flow_bytes_cache_size = 100000
+_flow_bytes_cache_lock = threading.Lock()
+
+def flow_bytes(
+        flowids: Iterable[int],
+          start: datetime.datetime,
+            end: datetime.datetime = datetime.datetime.now(),
+       timezone: str = '-05:00',
+     batch_size: int = 1000
+) -> Dict[int, int]:
+
+    # Total bytes of many flows resolving up to batch_size flow_ids per request,
+    # flows without a flow record are absent from the result (safe to call from multiple threads)
+
+    result = {}
+    pending = []
+    with _flow_bytes_cache_lock:
+        for flowid in set(flowids):
+            if flowid in _flow_bytes_cache:
+                _flow_bytes_cache.move_to_end(flowid)
+                result[flowid] = _flow_bytes_cache[flowid]
+            else:
+                pending += [flowid]
+
+    es = httpclient.elasticsearch()
+    path = f'/{indices(start, end)}/_search'
+    params = {'ignore_unavailable':'true', 'filter_path':'hits.hits._source'}
+
+    for i in range(0, len(pending), batch_size):
+        batch = pending[i:i+batch_size]
+
+        # One hit per flow, a flow can have several flow records (eg reindexed by index mode after a restart)
+        # which would otherwise push others out of the page
+        query = {
+            'size': len(batch),
+            'track_total_hits': False,
+            'collapse': {'field': 'flow_id'},
+            '_source': ['flow_id', 'flow.bytes_toclient', 'flow.bytes_toserver'],
+            'query': {
+                'bool': {
+                    'filter': [
+                        {
+                            'term': {
+                                'event_type': 'flow'
+                            }
+                        },
+                        {
+                            'terms': {
+                                'flow_id': batch
+                            }
+                        },
+                        {
+                            'range': {
+                                'timestamp': {
+                                    'gte': start.isoformat(),
+                                    'lte': 'now',
+                                    'time_zone': timezone
+                                }
                             }
                         }
-                    }
-                ]
+                    ]
+                }
             }
         }
-    }
 
-    url = f'http://127.0.0.1:9200/{",".join(indices)}/_search'
+        resp = es.post(path, params=params, json_body=query)
+        resp.raise_for_status()
+
+        for hit in resp.json().get('hits', {}).get('hits', []):
+            source = hit['_source']
+            result[source['flow_id']] = source['flow']['bytes_toclient'] + source['flow']['bytes_toserver']
 
-    resp = requests.post(url, json=query, timeout=100)
-    resp.raise_for_status()
+        with _flow_bytes_cache_lock:
+            for flowid in batch:
+                if flowid in result:
+                    _flow_bytes_cache[flowid] = result[flowid]
+                    if len(_flow_bytes_cache) > _flow_bytes_cache_size:
+                        _flow_bytes_cache.popitem(last=False)
 
-    hits = resp.json()['hits']['hits']
-    assert len(hits) in [0, 1]
-    return None if len(hits) == 0 else hits[0]
+    missing = len(pending) - len([f for f in pending if f in result])
+    if missing > 0:
+        logging.warning('%d flow records missing', missing)
 
+    return result
@@ -1,19 +1,32 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mailer
+
+import atexit
 import email.mime.text
 import json
-import os
-import smtplib
 from typing import Union
 
 
+_creds_cache = None
+_transport_cache = None
+
 def send(to:Union[str,None], subject:str, body:str, html:bool=False) -> None:
-    with open(os.path.join(os.path.dirname(__file__), 'gmail.json')) as file:
-        creds = json.load(file)
-    username = creds['username']
-    assert username.endswith('@gmail.com')
-    password = creds['password']
+    # The credentials and authenticated session are reused for all sends from the same process
+
+    global _creds_cache, _transport_cache
+    if _creds_cache is None:
+        with open(os.path.join(os.path.dirname(__file__), 'gmail.json')) as file:
+            _creds_cache = json.load(file)
+        assert _creds_cache['username'].endswith('@gmail.com')
+
+    username = _creds_cache['username']
+    password = _creds_cache['password']
 
     if to is None:
-        to = creds['default']
+        to = _creds_cache['default']
 
     if html:
         m = email.mime.text.MIMEText(body, 'html')
@@ -24,9 +37,8 @@ def send(to:Union[str,None], subject:str, body:str, html:bool=False) -> None:
     else:
         mail = f'Subject: {subject}\nFrom: {username}\nTo: {to}\n\n{body}'
 
-    smtp = smtplib.SMTP('smtp.gmail.com', 587)
-    smtp.ehlo()
-    smtp.starttls()
-    smtp.login(username, password)
-    smtp.sendmail(username, to, mail)
-    smtp.close()
+    if _transport_cache is None:
+        _transport_cache = mailer.Transport('smtp.gmail.com', 587, username, password, starttls=True, retries=5)
+        atexit.register(_transport_cache.close)
+
+    _transport_cache.send(username, to, mail)
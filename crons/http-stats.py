@@ -3,160 +3,301 @@
 import elasticsearch
 import gmail
 import kibana
+import report
+import rollup
 
+import requests
+
+import argparse
 import collections
+import concurrent.futures
 import datetime
-import io
 import logging
+import time
+from typing import Any, Callable, Dict, List, Set, Tuple
 
 
-if __name__ == '__main__':
-    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(levelname)s:%(filename)s:%(lineno)d:%(message)s')
-    #logging.getLogger().disabled = True
+# Event types and the field holding the hostname,
+# the keyword subfield (from the default dynamic mapping) is used when aggregating
+FIELDS = {
+    'http': 'http.hostname',
+    'tls': 'tls.sni'
+}
 
-    #
-    # Gather the data
-    #
 
-    start = datetime.datetime.now() - datetime.timedelta(days=7)
-    query = {
-        'size': 5000,
-        'query': {
-            'bool': {
-                'must': [
-                    {
-                        'match': {
-                            'event_type': 'http'
-                        }
-                    },
-                    {
-                        'range': {
-                            'timestamp': {
-                                'gte': start.isoformat(),
-                                'lte': 'now',
-                                'time_zone': '-05:00'
-                            }
+def event_query(
+    event_type: str,
+         start: datetime.datetime,
+           end: datetime.datetime
+) -> Dict[str, Dict]:
+
+    return {
+        'bool': {
+            'must': [
+                {
+                    'match': {
+                        'event_type': event_type
+                    }
+                },
+                {
+                    'range': {
+                        'timestamp': {
+                            'gte': start.isoformat(),
+                            'lt': end.isoformat(),
+                            'time_zone': '-05:00'
                         }
                     }
-                ]
-            }
-        },
+                }
+            ]
+        }
+    }
+
+
+def collect_client(
+    event_type: str,
+         start: datetime.datetime,
+           end: datetime.datetime
+) -> Dict[int, str]:
+
+    # Hostname of each flow by scanning every event
+    query = {
+        'size': 5000,
+        'query': event_query(event_type, start, end),
         'sort': [
-            { 'timestamp': 'asc' },
-            { '_id': 'asc' }
+            { 'timestamp': 'asc' }
         ]
     }
 
-    http_entries = {}
-    for record in elasticsearch.search(query, start):
+    section, field = FIELDS[event_type].split('.')
+
+    hostnames = {}
+    for record in elasticsearch.search(query, start, end, source=['flow_id', FIELDS[event_type]]):
         flow_id = record['_source']['flow_id']
-        if 'hostname' not in record['_source']['http']:
-            logging.warning('http record with http.hostname missing (flow_id = %d)', flow_id) 
+        if field not in record['_source'].get(section, {}):
+            logging.warning('%s record with %s missing (flow_id = %d)', event_type, FIELDS[event_type], flow_id)
             continue
-        hostname = record['_source']['http']['hostname']
+        hostname = record['_source'][section][field]
 
-        if flow_id in http_entries:
-            assert http_entries[flow_id]['hostname'] == hostname
+        if flow_id in hostnames:
+            assert hostnames[flow_id] == hostname
         else:
-            flow_record = elasticsearch.flow(flow_id, start)
-            if flow_record is None:
-                logging.warning('flow record with flow_id = %d missing', flow_id)
-                bandwidth = 0
-            else:
-                bandwidth = flow_record['_source']['flow']['bytes_toclient'] + \
-                            flow_record['_source']['flow']['bytes_toserver']
-
-            http_entries[flow_id] = {'hostname':hostname, 'bandwidth':bandwidth}
-
-    query['query']['bool']['must'][0]['match']['event_type'] = 'tls'
-    tls_entries = {}
-    for record in elasticsearch.search(query, start):
-        flow_id = record['_source']['flow_id']
-        hostname = record['_source']['tls']['sni']
+            hostnames[flow_id] = hostname
+
+    return hostnames
+
+
+def collect_server(
+    event_type: str,
+         start: datetime.datetime,
+           end: datetime.datetime
+) -> Dict[int, str]:
 
-        if flow_id in tls_entries:
-            assert tls_entries[flow_id]['hostname'] == hostname
+    # Hostname of each flow from the distinct (hostname, flow_id) pairs aggregated by Elasticsearch,
+    # ie one bucket per flow rather than every event of it
+    sources = [
+        { 'hostname': { 'terms': { 'field': FIELDS[event_type] + '.keyword' } } },
+        { 'flow_id': { 'terms': { 'field': 'flow_id' } } }
+    ]
+
+    hostnames = {}
+    for bucket in elasticsearch.composite(event_query(event_type, start, end), sources, start, end):
+        flow_id = bucket['key']['flow_id']
+        hostname = bucket['key']['hostname']
+
+        if flow_id in hostnames:
+            assert hostnames[flow_id] == hostname
         else:
-            flow_record = elasticsearch.flow(flow_id, start)
-            if flow_record is None:
-                logging.warning('flow record with flow_id = %d missing', flow_id)
-                bandwidth = 0
-            else:
-                bandwidth = flow_record['_source']['flow']['bytes_toclient'] + \
-                            flow_record['_source']['flow']['bytes_toserver']
+            hostnames[flow_id] = hostname
 
-            tls_entries[flow_id] = {'hostname':hostname, 'bandwidth':bandwidth}
+    return hostnames
 
-    #
-    # Organize the data
-    #
 
-    http_entries_by_count = collections.defaultdict(int)
-    for entry in http_entries.values():
-        http_entries_by_count[entry['hostname']] += 1
+def collect(
+     event_type: str,
+          start: datetime.datetime,
+            end: datetime.datetime,
+    client_side: bool = False
+) -> Dict[int, str]:
 
-    http_entries_by_bandwidth = collections.defaultdict(int)
-    for entry in http_entries.values():
-        http_entries_by_bandwidth[entry['hostname']] += entry['bandwidth']
+    if not client_side:
+        try:
+            return collect_server(event_type, start, end)
+        except requests.exceptions.RequestException as e:
+            # Eg the hostname fields are not mapped as keywords
+            logging.warning('aggregation failed, falling back to client side: %s', e)
 
-    tls_entries_by_count = collections.defaultdict(int)
-    for entry in tls_entries.values():
-        tls_entries_by_count[entry['hostname']] += 1
+    return collect_client(event_type, start, end)
 
-    tls_entries_by_bandwidth = collections.defaultdict(int)
-    for entry in tls_entries.values():
-        tls_entries_by_bandwidth[entry['hostname']] += entry['bandwidth']
 
-    #
-    # Display the data
-    #
+def seen_before(
+    event_type: str,
+      flow_ids: List[int],
+         start: datetime.datetime
+) -> Set[int]:
 
-    body = io.StringIO()
+    # The flows with a hostname the day before start, ie a flow spanning midnight is counted on the day
+    # it was first seen rather than on each day (as it was when the whole window was scanned at once)
+    previous = start - datetime.timedelta(days=1)
 
-    body.write('<html><body>')
+    query = event_query(event_type, previous, start)
+    query['bool']['must'] += [
+        { 'exists': { 'field': FIELDS[event_type] } },
+        { 'terms': { 'flow_id': flow_ids } }
+    ]
+    sources = [
+        { 'flow_id': { 'terms': { 'field': 'flow_id' } } }
+    ]
 
-    # Gmail strips out specific css fields, defining columns using tables and whitelisted properties:
-    # https://julie.io/writing/gmail-first-strategy-for-responsive-emails/
+    return {bucket['key']['flow_id'] for bucket in elasticsearch.composite(query, sources, previous, start)}
 
-    prefix = '<table width="100%" align="left" style="width:100%; max-width:200px"><tr><td style="padding-left:10px; padding-right:10px">'
-    postfix = '</td></tr></table>'
 
-    body.write(f'{prefix}<h1>http connections</h1><ul>')
-    for entry in sorted(http_entries_by_count.items(), key=lambda i:i[1], reverse=True):
-        url = kibana.url(f'http.hostname:{entry[0]}', start)
-        body.write(f'<li><a href="{url}">{entry[0]}</a> {entry[1]}</li>')
-    body.write(f'</ul>{postfix}')
+def lookup(
+    event_type: str,
+     hostnames: Dict[int, str],
+         start: datetime.datetime,
+           end: datetime.datetime
+) -> Tuple[Dict[int, str], Dict[int, int]]:
 
-    def filesize(n: int) -> str:
-        if n < 1024:
-            return f'{n}B'
-        elif n < 1024**2:
-            return f'{n / float(1024):.2f}KB'
-        elif n < 1024**3:
-            return f'{n / float(1024**2):.2f}MB'
-        elif n < 1024**4:
-            return f'{n / float(1024**3):.2f}GB'
-        else:
-            return f'{n / float(1024**4):.2f}TB'
+    # The flows first seen on the day and their bytes
+    earlier = seen_before(event_type, list(hostnames.keys()), start)
+    hostnames = {flow_id: hostname for flow_id, hostname in hostnames.items() if flow_id not in earlier}
+    return hostnames, elasticsearch.flow_bytes(list(hostnames.keys()), start, end)
+
+
+class Totals:
+    # Connections and bandwidth per hostname for each day and event type,
+    # updated in a single pass as the flow lookups complete
+
+    def __init__(self, days: List[datetime.date]):
+        self.rollups = {day: {event_type: {} for event_type in FIELDS} for day in days}
 
-    body.write(f'{prefix}<h1>http bandwidth</h1><ul>')
-    for entry in sorted(http_entries_by_bandwidth.items(), key=lambda i:i[1], reverse=True):
-        url = kibana.url(f'http.hostname:{entry[0]}', start)
-        body.write(f'<li><a href="{url}">{entry[0]}</a> {filesize(entry[1])}</li>')
-    body.write(f'</ul>{postfix}')
 
-    body.write(f'{prefix}<h1>tls connections</h1><ul>')
-    for entry in sorted(tls_entries_by_count.items(), key=lambda i:i[1], reverse=True):
-        url = kibana.url(f'tls.sni:{entry[0]}', start)
-        body.write(f'<li><a href="{url}">{entry[0]}</a> {entry[1]}</li>')
-    body.write(f'</ul>{postfix}')
+    def add(
+              self,
+               day: datetime.date,
+        event_type: str,
+         hostnames: Dict[int, str],
+        flow_bytes: Dict[int, int]
+    ) -> None:
 
-    body.write(f'{prefix}<h1>tls bandwidth</h1><ul>')
-    for entry in sorted(tls_entries_by_bandwidth.items(), key=lambda i:i[1], reverse=True):
-        url = kibana.url(f'tls.sni:{entry[0]}', start)
-        body.write(f'<li><a href="{url}">{entry[0]}</a> {filesize(entry[1])}</li>')
-    body.write(f'</ul>{postfix}')
+        # Flows without a flow record count as zero bytes
+        entries = self.rollups[day][event_type]
+        for flow_id, hostname in hostnames.items():
+            entry = entries.setdefault(hostname, [0, 0])
+            entry[0] += 1
+            entry[1] += flow_bytes.get(flow_id, 0)
+
+
+def timed(func: Callable, *args) -> Tuple[Any, float]:
+    began = time.monotonic()
+    result = func(*args)
+    return result, time.monotonic() - began
+
+
+def summarize(
+           days: List[datetime.date],
+    client_side: bool = False,
+        workers: int = 4,
+     batch_size: int = 1000
+) -> Dict[datetime.date, Dict[str, Dict[str, List[int]]]]:
+
+    # Connections and bandwidth per hostname of the flows first seen on each day, for each event type.
+    # The scans of each day and event type run concurrently, as each completes its flows are
+    # looked up in batches (also concurrently) and the results aggregated as they arrive.
+
+    totals = Totals(days)
+    timings = collections.defaultdict(float)
+    finished = {}
+    began = time.monotonic()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        for day in days:
+            start = datetime.datetime.combine(day, datetime.time())
+            end = start + datetime.timedelta(days=1)
+            for event_type in FIELDS:
+                future = executor.submit(timed, collect, event_type, start, end, client_side)
+                pending[future] = ('scan', day, event_type, start, end)
+
+        while len(pending) > 0:
+            done, _ = concurrent.futures.wait(pending.keys(), return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                stage, day, event_type, start, end = pending.pop(future)
+                result, elapsed = future.result()
+                timings[stage] += elapsed
+                finished[stage] = time.monotonic() - began
+
+                if stage == 'scan':
+                    logging.info('%s scan of %s took %.2fs (%d flows)', event_type, day, elapsed, len(result))
+
+                    # Flow records are logged when flows end hence may be in the following day's index
+                    flow_ids = list(result.keys())
+                    for i in range(0, len(flow_ids), batch_size):
+                        batch = {flow_id: result[flow_id] for flow_id in flow_ids[i:i+batch_size]}
+                        future = executor.submit(timed, lookup, event_type, batch, start, end)
+                        pending[future] = ('lookup', day, event_type, start, end)
+
+                else:
+                    totals.add(day, event_type, *result)
+
+    for stage in ['scan', 'lookup']:
+        if stage in finished:
+            logging.info('%s stage finished after %.2fs (%.2fs of worker time)', stage, finished[stage], timings[stage])
+
+    return totals.rollups
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--client-side', '-c', action='store_true',
+                        help='aggregate by scanning every event rather than in elasticsearch')
+    parser.add_argument('--days', '-d', type=int, default=7, help='days before today to report on')
+    parser.add_argument('--workers', '-w', type=int, default=4, help='concurrent elasticsearch requests')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(levelname)s:%(filename)s:%(lineno)d:%(message)s')
+    #logging.getLogger().disabled = True
+
+    #
+    # Gather the data
+    #
+
+    # Completed days are summarized once and stored, only the current day is computed on every run
+    today = datetime.date.today()
+    days = [today - datetime.timedelta(days=i) for i in range(args.days, -1, -1)]
+    start = datetime.datetime.combine(days[0], datetime.time())
+
+    began = time.monotonic()
+    rollups = rollup.collect('http-stats', days, lambda days: summarize(days, args.client_side, args.workers), today)
+    logging.info('gathering took %.2fs', time.monotonic() - began)
+
+    #
+    # Organize the data
+    #
+
+    entries = rollup.merge(rollups)
+    http_entries = entries.get('http', {})
+    tls_entries = entries.get('tls', {})
+
+    http_entries_by_count = {hostname: entry[0] for hostname, entry in http_entries.items()}
+    http_entries_by_bandwidth = {hostname: entry[1] for hostname, entry in http_entries.items()}
+    tls_entries_by_count = {hostname: entry[0] for hostname, entry in tls_entries.items()}
+    tls_entries_by_bandwidth = {hostname: entry[1] for hostname, entry in tls_entries.items()}
+
+    #
+    # Display the data
+    #
 
-    body.write('</body></html>')
+    began = time.monotonic()
+    body = report.render([
+        ('http connections', 'http.hostname', http_entries_by_count,     str),
+        ('http bandwidth',   'http.hostname', http_entries_by_bandwidth, report.filesize),
+        ('tls connections',  'tls.sni',       tls_entries_by_count,      str),
+        ('tls bandwidth',    'tls.sni',       tls_entries_by_bandwidth,  report.filesize)
+    ], lambda field, hostname: kibana.url(f'{field}:{hostname}', start))
+    logging.info('rendering took %.2fs', time.monotonic() - began)
 
-    gmail.send(None, 'frosty http-stats', body.getvalue(), html=True)
+    # Only once everything has been gathered
+    began = time.monotonic()
+    gmail.send(None, 'frosty http-stats', body, html=True)
+    logging.info('sending took %.2fs', time.monotonic() - began)
@@ -0,0 +1,48 @@
+import html
+import io
+from typing import Callable, Dict, List, Tuple, Union
+
+
+def filesize(n: int) -> str:
+    if n < 1024:
+        return f'{n}B'
+    elif n < 1024**2:
+        return f'{n / float(1024):.2f}KB'
+    elif n < 1024**3:
+        return f'{n / float(1024**2):.2f}MB'
+    elif n < 1024**4:
+        return f'{n / float(1024**3):.2f}GB'
+    else:
+        return f'{n / float(1024**4):.2f}TB'
+
+
+def render(
+    sections: List[Tuple[str, str, Dict[str, int], Callable[[int], str]]],
+         url: Union[Callable[[str, str], str], None] = None
+) -> str:
+
+    # Sections of title, query field, value per hostname and value formatter rendered as columns,
+    # hostnames are linked to url(field, hostname) if given (eg to the records in Kibana)
+    body = io.StringIO()
+
+    body.write('<html><body>')
+
+    # Gmail strips out specific css fields, defining columns using tables and whitelisted properties:
+    # https://julie.io/writing/gmail-first-strategy-for-responsive-emails/
+
+    prefix = '<table width="100%" align="left" style="width:100%; max-width:200px"><tr><td style="padding-left:10px; padding-right:10px">'
+    postfix = '</td></tr></table>'
+
+    for title, field, values, formatter in sections:
+        body.write(f'{prefix}<h1>{title}</h1><ul>')
+        # Ties by hostname so that the order doesn't depend on how the values were gathered
+        for entry in sorted(values.items(), key=lambda i:(-i[1], i[0])):
+            if url is not None:
+                body.write(f'<li><a href="{url(field, entry[0])}">{entry[0]}</a> {formatter(entry[1])}</li>')
+            else:
+                body.write(f'<li>{html.escape(entry[0])} {formatter(entry[1])}</li>')
+        body.write(f'</ul>{postfix}')
+
+    body.write('</body></html>')
+
+    return body.getvalue()
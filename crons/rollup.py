@@ -0,0 +1,113 @@
+import datetime
+import json
+import logging
+import os
+from typing import Callable, Dict, Iterable, List, Union
+
+
+# Per day summaries of settled days (whose indices no longer change) kept so that reports
+# only have to compute the recent days, stored as rollups/<name>-YYYYMMDD.json
+
+ROLLUP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rollups')
+
+# Days after which a day's indices are taken to no longer change, records arrive late after midnight
+# (eg backfilled by index mode or the flow records of flows ending after midnight)
+SETTLE_DAYS = 1
+
+
+def settled(
+      day: datetime.date,
+    today: datetime.date
+) -> bool:
+
+    return day < today - datetime.timedelta(days=SETTLE_DAYS)
+
+
+def path(
+    name: str,
+     day: datetime.date
+) -> str:
+
+    return os.path.join(ROLLUP_DIR, f'{name}-{day.strftime("%Y%m%d")}.json')
+
+
+def load(
+    name: str,
+     day: datetime.date
+) -> Union[Dict, None]:
+
+    try:
+        # Stored before the day settled (eg by an earlier version), ie possibly missing late records
+        if os.path.getmtime(path(name, day)) < \
+           datetime.datetime.combine(day + datetime.timedelta(days=SETTLE_DAYS + 1), datetime.time()).timestamp():
+            return None
+
+        with open(path(name, day)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        logging.error('invalid rollup %s: %s', path(name, day), e)
+        return None
+
+
+def save(
+    name: str,
+     day: datetime.date,
+    data: Dict
+) -> None:
+
+    os.makedirs(ROLLUP_DIR, exist_ok=True)
+
+    tmppath = path(name, day) + '.tmp'
+    with open(tmppath, 'w') as file:
+        json.dump(data, file, separators=(',', ':'))
+    os.replace(tmppath, path(name, day))
+
+
+def collect(
+       name: str,
+       days: Iterable[datetime.date],
+    compute: Callable[[List[datetime.date]], Dict[datetime.date, Dict]],
+      today: Union[datetime.date, None] = None
+) -> List[Dict]:
+
+    # Rollups of the given days, computing (and storing, for settled days) those not stored yet,
+    # the missing days are passed to compute together so that they can be computed concurrently
+
+    if today is None:
+        today = datetime.date.today()
+
+    days = list(days)
+    rollups = {}
+    for day in days:
+        data = load(name, day) if settled(day, today) else None
+        if data is not None:
+            rollups[day] = data
+
+    missing = [day for day in days if day not in rollups]
+    if len(missing) > 0:
+        computed = compute(missing)
+        for day in missing:
+            rollups[day] = computed[day]
+            if settled(day, today):
+                save(name, day, computed[day])
+                logging.info('stored rollup %s', path(name, day))
+
+    return [rollups[day] for day in days]
+
+
+def merge(rollups: Iterable[Dict[str, Dict[str, List[int]]]]) -> Dict[str, Dict[str, List[int]]]:
+    # Sums rollups of the form {section: {key: [value, ...]}} elementwise
+
+    merged = {}
+    for rollup in rollups:
+        for section, entries in rollup.items():
+            target = merged.setdefault(section, {})
+            for key, values in entries.items():
+                if key in target:
+                    target[key] = [a + b for a, b in zip(target[key], values)]
+                else:
+                    target[key] = list(values)
+
+    return merged
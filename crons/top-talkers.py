@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gmail
+import report
+
+import topk
+
+import argparse
+import json
+import logging
+import time
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--snapshot', '-s', default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                                 'top-talkers.json'),
+                        help='top talkers written by minimal mode')
+    parser.add_argument('--days', '-d', type=int, default=7, help='days before today to report on')
+    parser.add_argument('--limit', '-l', type=int, default=100, help='hostnames per section')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(levelname)s:%(filename)s:%(lineno)d:%(message)s')
+
+    with open(args.snapshot) as file:
+        snapshot = json.load(file)
+
+    if time.time() - snapshot['updated'] > 3600:
+        logging.warning('snapshot %s last updated %s', args.snapshot, time.ctime(snapshot['updated']))
+
+    # The periods (days by default) overlapping the report window, including the current one
+    since = time.time() - args.days * 86400 - snapshot['period']
+    periods = [apps for start, apps in snapshot['periods'].items() if int(start) >= since]
+
+    sections = []
+    for app, field in [('http', 'http.hostname'), ('tls', 'tls.sni')]:
+        for measure, title, formatter in [('connections', 'connections', str), ('bytes', 'bandwidth', report.filesize)]:
+            items = topk.merge([apps.get(app, {}).get(measure, []) for apps in periods])
+            values = {key: count for key, count, _ in items[:args.limit]}
+            sections += [(f'{app} {title}', field, values, formatter)]
+
+    # Counts are approximate (overestimates of the less frequent hostnames)
+    gmail.send(None, 'frosty top-talkers', report.render(sections), html=True)
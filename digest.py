@@ -0,0 +1,135 @@
+import collections
+import email.mime.application
+import email.mime.multipart
+import email.mime.text
+import gzip
+import io
+import json
+
+
+class CappedWriter:
+    # Text buffer that stops accepting writes once the cap is reached
+
+    def __init__(self, cap):
+        self.cap = cap
+        self.size = 0
+        self.truncated = False
+        self.__buf = io.StringIO()
+
+
+    def write(self, text):
+        if self.truncated:
+            return False
+        if self.size + len(text) > self.cap:
+            self.truncated = True
+            return False
+
+        self.__buf.write(text)
+        self.size += len(text)
+        return True
+
+
+    def getvalue(self):
+        return self.__buf.getvalue()
+
+
+def summarize(entries, overflow):
+    # Per signature totals over the aggregated entries and the evicted entry summaries
+
+    signatures = collections.OrderedDict()
+
+    for e in entries + overflow:
+        s = signatures.get(e['signature_id'])
+        if s is None:
+            s = signatures[e['signature_id']] = {
+                'signature_id': e['signature_id'],
+                'signature': e['signature'],
+                'count': 0,
+                'flows': 0,
+                'first_seen': e['first_seen'],
+                'last_seen': e['last_seen']
+            }
+
+        s['count'] += e['count']
+        s['flows'] += e.get('flows', 1)
+        s['first_seen'] = min(s['first_seen'], e['first_seen'])
+        s['last_seen'] = max(s['last_seen'], e['last_seen'])
+
+    return sorted(signatures.values(), key=lambda s: s['count'], reverse=True)
+
+
+def sensor_prefix(entry):
+    # Source sensor when following several eve files (see minimal.Parser), eg "[eth0] "
+    return f"[{entry['sensor']}] " if entry.get('sensor') is not None else ''
+
+
+def flow_context(entry):
+    # Flow context added in minimal mode (if the flow was tracked), eg " [example.com, 1234 bytes, 5s]"
+    context = entry.get('flow')
+    if context is None:
+        return ''
+
+    fields = []
+    if 'hostname' in context:
+        fields += [context['hostname']]
+    if 'bytes_toserver' in context:
+        fields += [f"{context['bytes_toserver'] + context['bytes_toclient']} bytes"]
+    if 'duration' in context:
+        fields += [f"{context['duration']}s"]
+    return f" [{', '.join(fields)}]" if len(fields) > 0 else ''
+
+
+def render_body(writer, count, entries, overflow, dropped):
+    signatures = summarize(entries, overflow)
+
+    writer.write(f'{count} alerts, {len(signatures)} signatures, {len(entries)} entries\n\n')
+
+    writer.write(f'{"count":>8} {"flows":>6}  {"first seen":<32} {"last seen":<32} signature\n')
+    for s in signatures:
+        if not writer.write(f"{s['count']:>8} {s['flows']:>6}  {s['first_seen']:<32} {s['last_seen']:<32} "
+                            f"{s['signature']} ({s['signature_id']})\n"):
+            break
+
+    if dropped > 0:
+        writer.write(f'\n{dropped} further alerts omitted\n')
+
+    writer.write(f'\n{"count":>8}  {"first seen":<32} {"source":<40} {"destination":<40} {"flow id":<18} signature\n')
+    written = 0
+    for e in entries:
+        if not writer.write(f"{e['count']:>8}  {e['first_seen']:<32} {str(e['src_ip']):<40} {str(e['dest_ip']):<40} "
+                            f"{str(e['flow_id']):<18} {sensor_prefix(e)}{e['signature']}{flow_context(e)}\n"):
+            break
+        written += 1
+
+    return written
+
+
+def render_attachment(entries, overflow):
+    # Gzipped NDJSON of the entries (including their sample records), written as it is compressed
+
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as file:
+        for e in entries + overflow:
+            file.write(json.dumps(e, separators=(',', ':')).encode() + b'\n')
+    return buf.getvalue()
+
+
+def render(subject, from_addr, to_addr, count, entries, overflow, dropped, max_body_size=256*1024):
+    writer = CappedWriter(max_body_size)
+    written = render_body(writer, count, entries, overflow, dropped)
+
+    body = writer.getvalue()
+    if writer.truncated:
+        body += f'\n[truncated, {len(entries) - written} entries not shown, refer to the attachment]\n'
+
+    message = email.mime.multipart.MIMEMultipart()
+    message['Subject'] = subject
+    message['From'] = from_addr
+    message['To'] = to_addr
+    message.attach(email.mime.text.MIMEText(body, 'plain'))
+
+    attachment = email.mime.application.MIMEApplication(render_attachment(entries, overflow), 'gzip')
+    attachment.add_header('Content-Disposition', 'attachment', filename='alerts.ndjson.gz')
+    message.attach(attachment)
+
+    return message.as_bytes()
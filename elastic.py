@@ -1,172 +1,191 @@
-import dateparser
-import requests
-
-import collections
+import batching
+import evetime
+import httpclient
+import journal
+import mailer
+import metrics
+import ndjson
+
+import asyncio
 import datetime
 import json
 import logging
 import queue
 import signal
-import smtplib
-import socket
 import threading
 import time
 
 
-alert_queue = queue.Queue()
+# Bounded, spills to the journal (when opened) under pressure
+alert_queue = journal.SpillQueue()
 
 
-class ListenerWorker(threading.Thread):
-    def __init__(self, sock):
+class Listener(threading.Thread):
+    def __init__(self, host='127.0.0.1', port=7834):
         threading.Thread.__init__(self)
         self.daemon = False
-        self.name = f'ListenerWorker{sock.fileno()}'
+        self.name = 'Listener'
 
-        self.__sock = sock
+        self.host = host
+        self.port = port
+
+        # Single event loop serving all connections, only accessed from within it apart from stop()
+        self.__loop = asyncio.new_event_loop()
+        self.__server = None
+        self.__tasks = set()
         self.__stop = False
 
+        self.__stats = metrics.registry.stats('listener')
+
 
     def run(self):
-        self.__sock.settimeout(1)
+        asyncio.set_event_loop(self.__loop)
+        try:
+            self.__loop.run_until_complete(self.__serve())
 
-        buf = b''
+            # Alerts still waiting for room in the queue (see __handle) are queued before the notifier is stopped
+            self.__loop.run_until_complete(self.__loop.shutdown_default_executor())
+        finally:
+            self.__loop.close()
 
-        stats = collections.defaultdict(int)
-        last = time.time()
 
-        while not self.__stop:
-            if len(stats) > 0 and time.time() - last >= 3600:
-                logging.info('stats: %s', ', '.join(['%s = %d' % (k, stats[k]) for k in sorted(stats.keys())]))
-                stats = collections.defaultdict(int)
-                last = time.time()
+    async def __serve(self):
+        self.__server = await asyncio.start_server(self.__handle, self.host, self.port, reuse_address=True)
+        if self.__stop:
+            self.__server.close()
 
-            try:
-                b = self.__sock.recv(1024)
-            except socket.timeout as e:
-                continue
+        stats_task = self.__loop.create_task(self.__log_stats())
 
-            # Socket closed by peer
-            if b == b'':
-                break
-            logging.debug('b = %r', b)
+        await self.__server.wait_closed()
 
-            buf += b
-            lines = buf.splitlines(keepends=True)
-            buf = b''
+        # Let the connection handlers finish their buffered lines
+        if self.__tasks:
+            await asyncio.gather(*self.__tasks, return_exceptions=True)
 
-            # Handle an incomplete last line
-            if lines[-1][-1] != ord('\n'):
-                buf = lines[-1]
-                lines = lines[:-1]
-                stats['incomplete'] += 1
+        stats_task.cancel()
 
-            for line in lines:
-                logging.info('received line: %r', line)
-                stats['lines-read'] += 1
 
-                try:
-                    record = json.loads(line)
-                except Exception as e:
-                    logging.error('error processing line = %r: %s', line, e)
-                    stats['bad-json'] += 1
-                    continue
+    async def __log_stats(self):
+        while True:
+            await asyncio.sleep(3600)
+            metrics.registry.log(self.__stats)
 
-                if record.get('event_type') != 'alert':
-                    stats['non-alerts'] += 1
-                    continue
 
-                alert_queue.put(line)
+    async def __handle(self, reader, writer):
+        task = asyncio.current_task()
+        self.__tasks.add(task)
 
-        if buf != b'':
-            logging.warning('unused buffer: %r', buf)
+        info = writer.get_extra_info('peername')
+        logging.info('received a connection from %s:%d', info[0], info[1])
+        self.__stats['connections'] += 1
 
-        self.__sock.close()
+        framer = ndjson.Framer()
 
+        try:
+            while True:
+                b = await reader.read(256*1024)
 
-    def stop(self):
-        self.__stop = True
+                # Connection closed by peer
+                if b == b'':
+                    break
+                logging.debug('b = %r', b)
 
+                for line in framer.feed(b):
+                    logging.debug('received line: %r', line)
+                    self.__stats['lines-read'] += 1
 
-class Listener(threading.Thread):
-    def __init__(self):
-        threading.Thread.__init__(self)
-        self.daemon = False
-        self.name = 'Listener'
+                    try:
+                        record = json.loads(line)
+                    except Exception as e:
+                        logging.error('error processing line = %r: %s', line, e)
+                        self.__stats['bad-json'] += 1
+                        continue
 
-        self.__stop = False
-        self.__workers = []
+                    if record.get('event_type') != 'alert':
+                        self.__stats['non-alerts'] += 1
+                        continue
 
+                    # Waiting for room (when the queue is full and there is no journal) is done off the event loop
+                    # so that the other connections are still served, this one isn't read from meanwhile
+                    try:
+                        alert_queue.put_nowait(line)
+                    except queue.Full:
+                        self.__stats['queue-full'] += 1
+                        await self.__loop.run_in_executor(None, alert_queue.put, line)
+                    metrics.alert_queued(record.get('timestamp'), time.time())
 
-    def run(self):
-        self.__server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.__server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.__server.bind(('127.0.0.1', 7834))
-        self.__server.listen()
-        self.__server.settimeout(1)
+                # Incomplete lines are carried forward and completed on a later read
+                if framer.partial():
+                    self.__stats['incomplete'] += 1
 
-        last = time.time()
+        except asyncio.CancelledError:
+            pass
 
-        while not self.__stop:
-            try:
-                client, info = self.__server.accept()
-            except socket.timeout:
-                continue
+        except ConnectionError as e:
+            logging.warning('connection from %s:%d failed: %s', info[0], info[1], e)
 
-            # Clean out dead worker threads periodically
-            if time.time() - last > 100:
-                self.__workers = [w for w in self.__workers if w.is_alive()]
-                last = time.time()
+        finally:
+            if framer.oversized > 0:
+                logging.warning('%d oversized lines dropped', framer.oversized)
+                self.__stats['oversized'] += framer.oversized
+            if framer.partial():
+                logging.warning('unused partial line from %s:%d', info[0], info[1])
 
-            logging.info('received a connection from %s:%d', info[0], info[1])
-            worker = ListenerWorker(client); worker.start()
-            self.__workers += [worker]
+            writer.close()
+            self.__tasks.discard(task)
 
-        self.__server.close()
+
+    def __shutdown(self):
+        self.__stop = True
+        if self.__server is not None:
+            self.__server.close()
+        for task in self.__tasks:
+            task.cancel()
 
 
     def stop(self):
-        self.__stop = True
-        for w in self.__workers:
-            if w.is_alive():
-                w.stop(); w.join()
+        if not self.__loop.is_closed():
+            self.__loop.call_soon_threadsafe(self.__shutdown)
 
 
 class Notifier(threading.Thread):
-    def __init__(self):
+    def __init__(self, urgent_severity=1, transport=None, window=300):
         threading.Thread.__init__(self)
         self.daemon = False
         self.name = 'Notifier'
 
-        self.__stop = False
+        self.__transport = transport if transport is not None else mailer.Transport('127.0.0.1')
+        self.__batcher = batching.Batcher(alert_queue, window=window, urgent_severity=urgent_severity,
+                                          decode=Notifier.decode)
+
+
+    @staticmethod
+    def decode(alert_line):
+        try:
+            return json.loads(alert_line)
+        except Exception as e:
+            logging.error('error processing line = %r: %s', alert_line, e)
+            return None
 
 
     def run(self):
         # Get the Kibana index pattern guid (used later when building Kibana urls)
 
-        index_pattern_guid = None
-
-        resp = requests.get('http://127.0.0.1:5601/api/saved_objects/_find',
-                             params = {'type':'index-pattern', 'search':'suricata-*'},
-                            timeout = 100)
-        resp.raise_for_status()
-        for pattern in resp.json()['saved_objects']:
-            guid = pattern.get('id')
-            if guid is None:
-                continue
-            if pattern.get('attributes', {}).get('title') == 'suricata-*':
-                index_pattern_guid = guid
-                break
+        index_pattern_guid = httpclient.index_pattern_guid('suricata-*')
 
         if index_pattern_guid is None:
             logging.error('unable to determine index pattern guid')
             return
         logging.debug('index_pattern_guid = %s', index_pattern_guid)
 
-        def mail_alerts(alert_lines):
+        def mail_alerts(aggregator):
+            count = len(aggregator)
+            entries, overflow, dropped = aggregator.flush()
+
             body = 'Subject: suricata alerts\r\nFrom: frosty@localhost\r\n'
 
             if False:
-                body += '\n'.join([json.dumps(a.decode(), indent=4) for a in alert_lines])
+                body += '\n'.join([json.dumps(e, indent=4) for e in entries])
             else:
                 def get(alert, keys):
                     curval = alert
@@ -181,8 +200,8 @@ class Notifier(threading.Thread):
                     url = 'http://127.0.0.1:5601/app/discover#/?' + \
                           '_g=(filters:!(),refreshInterval:(pause:!t,value:0),'
 
-                    start = (dateparser.parse(flowstart) - datetime.timedelta(minutes=60)).isoformat()
-                    end   = (dateparser.parse(timestamp) + datetime.timedelta(minutes=60)).isoformat()
+                    start = (evetime.parse(flowstart) - datetime.timedelta(minutes=60)).isoformat()
+                    end   = (evetime.parse(timestamp) + datetime.timedelta(minutes=60)).isoformat()
 
                     url += f"time:(from:'{start}',to:'{end}'))&" + \
                            '_a=(columns:!(event_type,src_ip,src_port,dest_ip,dest_port,proto,app_proto),' + \
@@ -192,12 +211,9 @@ class Notifier(threading.Thread):
                     return url
 
                 valid = False
-                for alert_line in alert_lines:
-                    try:
-                        alert = json.loads(alert_line)
-                    except Exception as e:
-                        logging.error('error processing line = %r: %s', alert_line, e)
-                        continue
+                for entry in entries:
+                    # Duplicates share the signature and flow, the first is representative
+                    alert = entry['samples'][0]
 
                     signature = get(alert, ['alert', 'signature'])
                     flowid    = get(alert, ['flow_id'])
@@ -206,72 +222,81 @@ class Notifier(threading.Thread):
                     if any([x is None for x in [signature, flowid, flowstart, timestamp]]):
                         continue
 
-                    body += f'{signature}\n{url(flowid, flowstart, timestamp)}\n\n'
-                    valid = True
+                    if entry['count'] > 1:
+                        signature += f" ({entry['count']} alerts)"
 
-                if not valid:
-                    return
+                    # Source sensor when index mode follows several eve files
+                    if alert.get('sensor') is not None:
+                        signature = f"[{alert['sensor']}] {signature}"
 
-            smtp = smtplib.SMTP('127.0.0.1')
-            smtp.sendmail('frosty@localhost', 'root@localhost', body)
-            smtp.quit()
-
-            logging.info('sent mail with %d alerts', len(alerts))
+                    body += f"{signature}\n{url(flowid, flowstart, entry['last_seen'])}\n\n"
+                    valid = True
 
-        last = time.time()
+                for o in overflow:
+                    body += f"{o['signature']} ({o['count']} further alerts in {o['flows']} flows)\n\n"
+                    valid = True
 
-        while not self.__stop:
-            if not alert_queue.empty() and time.time() - last >= 300:
-                alerts = []
-                while not alert_queue.empty():
-                    alerts += [alert_queue.get()]
-                    alert_queue.task_done()
+                if dropped > 0:
+                    body += f'{dropped} further alerts omitted\n'
 
-                mail_alerts(alerts)
-                last = time.time()
+                if not valid:
+                    return
 
-            time.sleep(1)
+            self.__transport.send('frosty@localhost', 'root@localhost', body)
 
-        if not alert_queue.empty():
-            alerts = []
-            while not alert_queue.empty():
-                alerts += [alert_queue.get()]
-                alert_queue.task_done()
+            logging.info('sent mail with %d alerts in %d entries', count, len(entries))
 
-            mail_alerts(alerts)
+        self.__batcher.run(mail_alerts)
+        self.__transport.close()
 
 
     def stop(self):
-        self.__stop = True
+        # Don't retry failed sends indefinitely once stopping, unsent journaled alerts are resent on restart
+        self.__transport.retries = 3
+        self.__batcher.stop()
+
+
+def main_elastic(journal_path=None, urgent_severity=1):
+    if journal_path is not None:
+        alert_queue.open(journal_path)
 
+    metrics.registry.gauge('alert_queue_depth', 'alerts pending (in memory and journaled)', alert_queue.qsize)
 
-def main_elastic():
     listener = Listener(); listener.start()
-    notifier = Notifier(); notifier.start()
+    notifier = Notifier(urgent_severity=urgent_severity); notifier.start()
 
     # Gracefully stop on terminating signal
 
+    stopped = False
+
     def stop(signum, frame):
+        nonlocal stopped
         logging.info('received signal %s', signal.Signals(signum).name)
         listener.stop(); listener.join()
-        notifier.stop(); alert_queue.join(); notifier.join()
+        notifier.stop()
+        if notifier.is_alive():
+            alert_queue.join()
+        notifier.join()
+        stopped = True
 
     for s in [signal.SIGINT, signal.SIGTERM]:
         signal.signal(s, stop)
 
-    # Gracefully stop if any individual thread stops
-
-    while True:
+    # Gracefully stop if any individual thread stops (unless already stopped by a signal)
+    while not stopped:
         if not listener.is_alive():
-            notifier.stop(); alert_queue.join(); notifier.join()
+            notifier.stop()
+            if notifier.is_alive():
+                alert_queue.join()
+            notifier.join()
             break
 
         if not notifier.is_alive():
             listener.stop(); listener.join()
-            while not alert_queue.empty():
-                alert = alert_queue.get()
-                alert_queue.task_done()
+            for alert in alert_queue.spill():
                 logging.error('unhandled alert: %s', alert)
+            if alert_queue.path is not None:
+                logging.error('pending alerts saved to %s', alert_queue.path)
             break
 
         time.sleep(1)
@@ -0,0 +1,182 @@
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+import ndjson
+
+import glob
+import json
+import logging
+import os
+import time
+
+
+# Use the faster json decoder when available
+loads = orjson.loads if orjson is not None else json.loads
+
+
+def event_type(line):
+    # Cheap byte level scan for the event type (without decoding the record), None if undetermined
+
+    i = line.find(b'"event_type":')
+    if i == -1:
+        return None
+    i += 13
+
+    while line[i:i+1] == b' ':
+        i += 1
+    if line[i:i+1] != b'"':
+        return None
+
+    j = line.find(b'"', i+1)
+    if j == -1:
+        return None
+
+    return line[i+1:j]
+
+
+def parse_alert(line, stats, t=None):
+    # Staged filter: reject by the scanned event type first (unless already scanned) and only fully decode candidates
+
+    if t is None:
+        t = event_type(line)
+    if t is not None and t != b'alert':
+        stats['prefilter-skipped'] += 1
+        return None
+
+    try:
+        record = loads(line)
+    except Exception as e:
+        logging.error('error processing line = %r: %s', line, e)
+        stats['bad-json'] += 1
+        return None
+
+    if record.get('event_type') != 'alert':
+        stats['decode-skipped'] += 1
+        return None
+
+    return record
+
+
+class EveReader:
+    def __init__(self, path, chunk_size=1024*1024, file=None):
+        self.path = path
+
+        # Unbuffered so that reads go straight into the reusable chunk buffer
+        self.__file = open(path, 'rb', buffering=0) if file is None else file
+        self.__chunk = bytearray(chunk_size)
+        self.__framer = ndjson.Framer()
+        self.__base = 0
+
+        self.inode = os.fstat(self.__file.fileno()).st_ino
+
+
+    @property
+    def offset(self):
+        # Offset of the first byte after the last complete line returned
+        return self.__base + self.__framer.consumed
+
+
+    @property
+    def oversized(self):
+        return self.__framer.oversized
+
+
+    def seek(self, offset):
+        self.__base = self.__file.seek(offset)
+        self.__framer.reset()
+
+
+    def seek_end(self):
+        self.__base = self.__file.seek(0, os.SEEK_END)
+        self.__framer.reset()
+
+
+    def size(self):
+        return os.fstat(self.__file.fileno()).st_size
+
+
+    def partial(self):
+        return self.__framer.partial()
+
+
+    def lines(self):
+        # Read all available data in large chunks and yield complete lines (without the newline),
+        # a trailing partial line is carried forward to the next call rather than seeking back
+
+        while True:
+            n = self.__file.readinto(self.__chunk)
+            if not n:
+                break
+
+            yield from self.__framer.feed(self.__chunk, n)
+
+
+    def close(self):
+        self.__file.close()
+
+
+def find_rotated(path, inode):
+    # Find the (uncompressed) rotated file with the given inode, eg eve.json.1
+
+    for rotated in sorted(glob.glob(glob.escape(path) + '.*')):
+        if rotated.endswith('.gz'):
+            continue
+        try:
+            if os.stat(rotated).st_ino == inode:
+                return rotated
+        except FileNotFoundError:
+            continue
+
+    return None
+
+
+class Checkpoint:
+    def __init__(self, path, interval=5):
+        self.path = path
+        self.interval = interval
+
+        self.__saved = None
+        self.__pending = None
+        self.__last = time.monotonic()
+
+
+    def load(self):
+        try:
+            with open(self.path) as file:
+                state = json.load(file)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.error('unable to load checkpoint %s: %s', self.path, e)
+            return None
+
+        self.__saved = (state['inode'], state['offset'])
+        return self.__saved
+
+
+    def update(self, reader):
+        self.set(reader.inode, reader.offset)
+
+
+    def set(self, inode, offset):
+        # Only record the position, it is written out at most once per interval
+
+        self.__pending = (inode, offset)
+        if time.monotonic() - self.__last >= self.interval:
+            self.flush()
+
+
+    def flush(self):
+        self.__last = time.monotonic()
+        if self.__pending is None or self.__pending == self.__saved:
+            return
+
+        inode, offset = self.__pending
+        tmppath = self.path + '.tmp'
+        with open(tmppath, 'w') as file:
+            json.dump({'inode': inode, 'offset': offset}, file)
+        os.replace(tmppath, self.path)
+
+        self.__saved = self.__pending
@@ -0,0 +1,29 @@
+import datetime
+import functools
+
+
+@functools.lru_cache(maxsize=64)
+def tzinfo(offset):
+    # Eg -0500 or -05:00
+    sign = -1 if offset[0] == '-' else 1
+    return datetime.timezone(sign * datetime.timedelta(hours=int(offset[1:3]), minutes=int(offset[-2:])))
+
+
+@functools.lru_cache(maxsize=16384)
+def parse(timestamp):
+    # Suricata eve timestamps have a fixed format, eg 2021-02-20T21:21:06.695534-0500,
+    # memoized as the same values recur (eg flow.start for every alert and record of a flow)
+
+    if len(timestamp) == 31 and timestamp[10] == 'T' and timestamp[19] == '.':
+        try:
+            return datetime.datetime(int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10]),
+                                     int(timestamp[11:13]), int(timestamp[14:16]), int(timestamp[17:19]),
+                                     int(timestamp[20:26]), tzinfo(timestamp[26:]))
+        except ValueError:
+            pass
+
+    # Anything else in (roughly) the same format, eg with a colon in the offset or without microseconds
+    try:
+        return datetime.datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S.%f%z')
+    except ValueError:
+        return datetime.datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S%z')
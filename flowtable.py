@@ -0,0 +1,181 @@
+import re
+import sys
+
+
+# Event types tracked and the fields extracted from them, found on the raw lines (rather than
+# decoding them) to keep up with the parser, eg "flow_id":1234 or "hostname":"example.com".
+# Only those the alert context is taken from, dns records (a large share of eve.json) are not tracked
+# as alerts on dns flows carry the query themselves (the dns metadata of the alert record).
+EVENT_TYPES = frozenset([b'flow', b'http', b'tls'])
+
+HOSTNAME = {
+    b'http': b'"hostname":"',
+    b'tls': b'"sni":"'
+}
+
+# Ref: https://suricata.readthedocs.io/en/latest/output/eve/eve-json-format.html#event-type-flow
+FLOW = re.compile(rb'"bytes_toserver":(\d+),"bytes_toclient":(\d+),"start":"[^"]*","end":"[^"]*","age":(\d+)')
+
+
+class Flow:
+    __slots__ = ('app', 'hostname', 'bytes_toserver', 'bytes_toclient', 'age')
+
+    def __init__(self):
+        self.app = None
+        self.hostname = None
+        self.bytes_toserver = None
+        self.bytes_toclient = None
+        self.age = None
+
+
+class FlowTable:
+    def __init__(self, max_flows=100000, timeout=3600, talkers=None):
+        # Two generations of plain dicts (cheaper per line than an ordered dict with per update reordering):
+        # flows are added to and updated in the current generation, when it holds half of max_flows or
+        # is older than half of timeout it becomes the previous generation, and the previous one is
+        # dropped.  Ie flows are kept for between half of and all of timeout seconds since last updated.
+        #
+        # Only the parser thread modifies the table, lookups from other threads are single dict
+        # operations (hence atomic).
+
+        self.max_flows = max_flows
+        self.timeout = timeout
+
+        # Optional topk.TopTalkers fed the http and tls hostnames of new flows and the bytes of their flows
+        self.talkers = talkers
+
+        self.__current = {}
+        self.__previous = {}
+        self.__rotated = None
+        self.evicted = 0
+        self.expired = 0
+
+
+    def __len__(self):
+        return len(self.__current) + len(self.__previous)
+
+
+    def __rotate(self):
+        dropped = len(self.__previous)
+        self.__previous = self.__current
+        self.__current = {}
+        return dropped
+
+
+    def update(self, event_type, line, now):
+        # Flow events are logged when flows end (ie after any alerts), only those of alerted flows are kept
+        # (and those of http and tls flows counted if counting top talkers)
+        if event_type == b'flow':
+            alerted = b'"alerted":true' in line
+            counted = self.talkers is not None and \
+                      (b'"app_proto":"http"' in line or b'"app_proto":"tls"' in line)
+            if not alerted and not counted:
+                return
+
+        i = line.find(b'"flow_id":')
+        j = line.find(b',', i)
+        if i == -1 or j == -1:
+            return
+        try:
+            flow_id = int(line[i+10:j])
+        except ValueError:
+            return
+
+        if event_type == b'flow':
+            self.__update_flow(flow_id, line, now, alerted, counted)
+            return
+
+        flow = self.__flow(flow_id, now)
+
+        # The first hostname seen
+        if flow.hostname is None:
+            key = HOSTNAME[event_type]
+            i = line.find(key)
+            j = line.find(b'"', i + len(key))
+            if i != -1 and j != -1:
+                flow.app = event_type
+                flow.hostname = line[i+len(key):j]
+
+                if self.talkers is not None:
+                    self.talkers.connection(event_type, flow.hostname, now)
+
+
+    def __flow(self, flow_id, now):
+        flow = self.__current.get(flow_id)
+        if flow is None:
+            flow = self.__previous.pop(flow_id, None)
+            if flow is None:
+                flow = Flow()
+            self.__current[flow_id] = flow
+
+            if len(self.__current) >= self.max_flows // 2:
+                self.evicted += self.__rotate()
+                self.__rotated = now
+
+        return flow
+
+
+    def __update_flow(self, flow_id, line, now, alerted, counted):
+        m = FLOW.search(line)
+        if m is None:
+            return
+        bytes_toserver, bytes_toclient, age = int(m.group(1)), int(m.group(2)), int(m.group(3))
+
+        if counted:
+            flow = self.__current.get(flow_id)
+            if flow is None:
+                flow = self.__previous.get(flow_id)
+            if flow is not None and flow.app in [b'http', b'tls']:
+                self.talkers.transfer(flow.app, flow.hostname, bytes_toserver + bytes_toclient, now)
+
+        if alerted:
+            flow = self.__flow(flow_id, now)
+            flow.bytes_toserver, flow.bytes_toclient, flow.age = bytes_toserver, bytes_toclient, age
+
+
+    def expire(self, now):
+        if self.__rotated is None:
+            self.__rotated = now
+        elif now - self.__rotated >= self.timeout / 2:
+            self.expired += self.__rotate()
+            self.__rotated = now
+
+
+    def lookup(self, flow_id):
+        # Context for enriching an alert, None if the flow is not tracked
+        flow = self.__current.get(flow_id)
+        if flow is None:
+            flow = self.__previous.get(flow_id)
+        if flow is None:
+            return None
+
+        context = {}
+        if flow.hostname is not None:
+            context['hostname'] = flow.hostname.decode(errors='replace')
+        if flow.bytes_toserver is not None:
+            context['bytes_toserver'] = flow.bytes_toserver
+            context['bytes_toclient'] = flow.bytes_toclient
+        if flow.age is not None:
+            context['duration'] = flow.age
+        return context
+
+
+    def memory(self, samples=100):
+        # Approximate bytes per tracked flow (entry, key and values plus the tables' own overhead),
+        # iterates the tables hence only to be called from the parser thread
+        count = len(self)
+        if count == 0:
+            return 0
+
+        total, sampled = 0, 0
+        for flows in [self.__current, self.__previous]:
+            for flow_id, flow in flows.items():
+                if sampled >= samples:
+                    break
+                total += sys.getsizeof(flow) + sys.getsizeof(flow_id)
+                for value in [flow.app, flow.hostname, flow.bytes_toserver, flow.bytes_toclient, flow.age]:
+                    if value is not None:
+                        total += sys.getsizeof(value)
+                sampled += 1
+
+        return total // sampled + (sys.getsizeof(self.__current) + sys.getsizeof(self.__previous)) // count
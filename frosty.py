@@ -1,8 +1,5 @@
 #!/usr/bin/env python3
 
-from elastic import main_elastic
-from minimal import main_minimal
-
 import argparse
 import logging
 import os
@@ -17,6 +14,29 @@ if __name__ == '__main__':
     mode_group = parser.add_mutually_exclusive_group(required=True)
     mode_group.add_argument('--minimal', '--min', '-m', action='store_true')
     mode_group.add_argument('--elastic', '--elk', '-e', action='store_true')
+    mode_group.add_argument('--index', '-i', action='store_true',
+                            help='index eve.json into elasticsearch (in place of logstash) and mail alerts as in elastic mode')
+    mode_group.add_argument('--replay', '-r', nargs='+', metavar='FILE',
+                            help='process archived eve.json(.gz) files as in minimal mode')
+
+    parser.add_argument('--urgent-severity', type=int, default=1,
+                        help='send alerts of this severity or higher (ie numerically lower) immediately, 0 to disable')
+    parser.add_argument('--journal', default='alerts.journal',
+                        help='alerts spilled to disk under pressure and pending acknowledgement (empty to disable)')
+    parser.add_argument('--eve', default='/var/log/suricata/eve.json',
+                        help='minimal/index mode eve.json, or a glob of several (eg /var/log/suricata/*/eve.json) '
+                             'with alerts tagged by the part matched')
+    parser.add_argument('--checkpoint', default='eve.checkpoint',
+                        help='minimal/index mode eve.json read position (empty to always start at the end)')
+    parser.add_argument('--max-flows', type=int, default=0,
+                        help='minimal mode flows tracked for adding context to alerts (eg 100000, costs about a third '
+                             'of the lines/sec the parser keeps up with per bench/flow-table.py), 0 to disable')
+    parser.add_argument('--top-talkers', default='',
+                        help='minimal mode http/tls hostnames by connections and bandwidth (eg top-talkers.json, '
+                             'requires --max-flows, together about two thirds of the lines/sec), empty to disable')
+    parser.add_argument('--bulk-workers', type=int, default=2, help='index mode _bulk requests in flight')
+    parser.add_argument('--metrics', default='127.0.0.1:9108',
+                        help='serve prometheus metrics on host:port or a unix socket path (empty to disable)')
 
     args = parser.parse_args()
 
@@ -38,10 +58,31 @@ if __name__ == '__main__':
         for handler in logging.root.handlers:
             handler.addFilter(LogFilter())
 
+    if args.metrics and not args.replay:
+        import metrics
+        metrics.Server(args.metrics).start()
+
+    # Only import the mode being run (and its dependencies)
+
     if args.minimal:
+        from minimal import main_minimal
         logging.info('running in minimal mode')
-        main_minimal()
+        main_minimal(path=args.eve, checkpoint=args.checkpoint or None, journal_path=args.journal or None,
+                     urgent_severity=args.urgent_severity, max_flows=args.max_flows,
+                     top_talkers=args.top_talkers or None)
 
     if args.elastic:
+        from elastic import main_elastic
         logging.info('running in elasticsearch mode')
-        main_elastic()
+        main_elastic(journal_path=args.journal or None, urgent_severity=args.urgent_severity)
+
+    if args.index:
+        from indexer import main_index
+        logging.info('running in index mode')
+        main_index(path=args.eve, checkpoint=args.checkpoint or None, journal_path=args.journal or None,
+                   urgent_severity=args.urgent_severity, workers=args.bulk_workers)
+
+    if args.replay:
+        from replay import main_replay
+        logging.info('running in replay mode')
+        main_replay(args.replay)
@@ -0,0 +1,130 @@
+import requests
+import requests.adapters
+import urllib3.util.retry
+
+import gzip
+import json
+import logging
+import threading
+import time
+
+
+ELASTICSEARCH_URL = 'http://127.0.0.1:9200'
+KIBANA_URL = 'http://127.0.0.1:5601'
+
+
+class Retry(urllib3.util.retry.Retry):
+    # Read errors and gateway errors (502/504) are only retried for idempotent methods (urllib3's default set),
+    # the request may have been applied (eg a _bulk request timing out after being indexed).  Connection errors
+    # and rejections (429/503, nothing was applied) are retried whatever the method.
+
+    REJECTED = [429, 503]
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if status_code in self.REJECTED and status_code in (self.status_forcelist or []):
+            return True
+        return urllib3.util.retry.Retry.is_retry(self, method, status_code, has_retry_after)
+
+
+class Client:
+    def __init__(self, base_url, timeout=100, retries=3, backoff=0.5, pool_size=10, compress=True):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+        # Request bodies larger than this are gzip compressed (None to disable), responses always may be
+        self.compress_size = 1024 if compress else None
+
+        # Retry connection errors and overload/unavailable responses with backoff, see Retry
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=[429, 502, 503, 504],
+                      raise_on_status=False)
+
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Accept-Encoding'] = 'gzip'
+
+
+    def request(self, method, path, params=None, json_body=None, data=None, headers=None, timeout=None):
+        headers = dict(headers) if headers is not None else {}
+
+        if json_body is not None:
+            data = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        elif isinstance(data, str):
+            data = data.encode()
+
+        if data is not None and self.compress_size is not None and len(data) > self.compress_size:
+            data = gzip.compress(data, compresslevel=1)
+            headers['Content-Encoding'] = 'gzip'
+
+        return self.session.request(method, self.base_url + path, params=params, data=data, headers=headers,
+                                    timeout=timeout if timeout is not None else self.timeout)
+
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
+
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def client(base_url, **kwargs):
+    # Shared per base url so that connections are pooled across callers
+
+    with _clients_lock:
+        if base_url not in _clients:
+            _clients[base_url] = Client(base_url, **kwargs)
+        return _clients[base_url]
+
+
+def elasticsearch():
+    return client(ELASTICSEARCH_URL)
+
+
+def kibana():
+    # Kibana expects the kbn-xsrf header on anything but reads, bodies are sent uncompressed
+    c = client(KIBANA_URL, compress=False)
+    c.session.headers['kbn-xsrf'] = 'true'
+    return c
+
+
+_index_pattern_guid_cache = {}
+
+def index_pattern_guid(title='suricata-*', ttl=3600):
+    # Kibana index pattern guid (used when building Kibana urls), None if not present
+
+    cached = _index_pattern_guid_cache.get(title)
+    if cached is not None and time.monotonic() - cached[1] < ttl:
+        return cached[0]
+
+    resp = kibana().get('/api/saved_objects/_find', params={'type':'index-pattern', 'search':title})
+    resp.raise_for_status()
+
+    guid = None
+    for pattern in resp.json()['saved_objects']:
+        if pattern.get('id') is None:
+            continue
+        if pattern.get('attributes', {}).get('title') == title:
+            guid = pattern['id']
+            break
+
+    if guid is None:
+        logging.warning('index pattern %s not found', title)
+        return None
+
+    _index_pattern_guid_cache[title] = (guid, time.monotonic())
+    return guid
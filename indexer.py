@@ -0,0 +1,372 @@
+import elastic
+import evefile
+import evetime
+import httpclient
+import metrics
+import minimal
+
+import requests
+
+import collections
+import datetime
+import json
+import logging
+import queue
+import signal
+import threading
+import time
+
+
+class Router:
+    def __init__(self, index_format='suricata-%Y%m%d'):
+        # Daily indices as Logstash wrote them (suricata-%{+yyyyMMdd}, ie by the UTC date of @timestamp),
+        # with @timestamp set to the event timestamp rather than the time of ingestion
+
+        self.index_format = index_format
+
+        # Bulk action lines per timestamp minute and offset, eg b'2021-02-20T21:21' b'-0500'
+        self.__actions = {}
+
+
+    def __action(self, when):
+        index = when.astimezone(datetime.timezone.utc).strftime(self.index_format)
+        return json.dumps({'index': {'_index': index}}, separators=(',', ':')).encode()
+
+
+    def route(self, line):
+        # Bulk action line and document for an eve line, found on the raw line (rather than decoding it)
+
+        i = line.find(b'"timestamp":"')
+        j = line.find(b'"', i + 13)
+        if i == -1 or j == -1 or line[:1] != b'{':
+            return self.__action(datetime.datetime.now(datetime.timezone.utc)), line
+
+        timestamp = line[i+13:j]
+        key = (timestamp[:16], timestamp[-5:])
+        action = self.__actions.get(key)
+        if action is None:
+            try:
+                action = self.__action(evetime.parse(timestamp.decode()))
+            except ValueError:
+                return self.__action(datetime.datetime.now(datetime.timezone.utc)), line
+
+            if len(self.__actions) >= 10000:
+                self.__actions.clear()
+            self.__actions[key] = action
+
+        return action, b'{"@timestamp":' + line[i+12:j+1] + b',' + line[1:]
+
+
+class BulkWriter:
+    def __init__(self, client=None, max_bytes=5*1024*1024, max_docs=5000, max_delay=5, workers=2, router=None):
+        # Lines are sent in _bulk requests of up to max_bytes or max_docs documents, or whatever accumulated
+        # within max_delay seconds, by workers threads (ie requests in flight).  At most workers further
+        # batches are queued, beyond that add() blocks, ie the tailer falls behind (on disk) rather than
+        # memory growing while Elasticsearch is slow or rejecting requests.
+
+        self.client = client if client is not None else httpclient.elasticsearch()
+        self.max_bytes = max_bytes
+        self.max_docs = max_docs
+        self.max_delay = max_delay
+        self.router = router if router is not None else Router()
+
+        self.__batch = []
+        self.__size = 0
+        self.__started = None
+
+        self.__queue = queue.Queue(maxsize=workers)
+        self.__workers = [threading.Thread(target=self.__send_loop, name=f'Bulk-{i}') for i in range(workers)]
+        for worker in self.__workers:
+            worker.start()
+
+        # Batches are numbered as they are filled, positions marked while a batch is being filled are
+        # acknowledged once it and every batch before it have been sent (in whichever order they complete)
+        self.__lock = threading.Lock()
+        self.__seq = 0
+        self.__done = -1
+        self.__completed = set()
+        self.__marks = collections.deque()
+
+        self.stopping = False
+
+        self.__stats = metrics.registry.stats('bulk')
+        self.__last = time.time()
+
+
+    def add(self, line):
+        action, doc = self.router.route(line)
+        self.__batch += [action, doc]
+        self.__size += len(action) + len(doc) + 2
+
+        if self.__started is None:
+            self.__started = time.monotonic()
+        if self.__size >= self.max_bytes or len(self.__batch) >= 2 * self.max_docs:
+            self.flush()
+
+
+    def qsize(self):
+        return self.__queue.qsize()
+
+
+    def mark(self, position, acknowledged):
+        # Call acknowledged(position) once every line added so far has been indexed
+
+        with self.__lock:
+            seq = self.__seq if len(self.__batch) > 0 else self.__seq - 1
+            if seq <= self.__done:
+                ready = True
+            else:
+                self.__marks.append((seq, position, acknowledged))
+                ready = False
+
+        if ready:
+            acknowledged(position)
+
+
+    def flush(self):
+        if len(self.__batch) == 0:
+            return
+
+        with self.__lock:
+            seq = self.__seq
+            self.__seq += 1
+
+        batch, self.__batch, self.__size, self.__started = self.__batch, [], 0, None
+        self.__queue.put((seq, batch))
+
+
+    def tick(self):
+        if self.__started is not None and time.monotonic() - self.__started >= self.max_delay:
+            self.flush()
+
+        if time.time() - self.__last >= 3600:
+            with self.__lock:
+                metrics.registry.log(self.__stats)
+            self.__last = time.time()
+
+
+    def __count(self, key, n):
+        with self.__lock:
+            self.__stats[key] += n
+
+
+    def __complete(self, seq):
+        acknowledged = []
+        with self.__lock:
+            self.__completed.add(seq)
+            while self.__done + 1 in self.__completed:
+                self.__done += 1
+                self.__completed.remove(self.__done)
+            while len(self.__marks) > 0 and self.__marks[0][0] <= self.__done:
+                acknowledged += [self.__marks.popleft()[1:]]
+
+        # Only the latest position of each callback matters
+        latest = {}
+        for position, callback in acknowledged:
+            latest[callback] = position
+        for callback, position in latest.items():
+            callback(position)
+
+
+    def __send_loop(self):
+        while True:
+            item = self.__queue.get()
+            if item is None:
+                break
+
+            seq, batch = item
+            if self.__send(batch):
+                self.__complete(seq)
+
+
+    def __send(self, batch):
+        # Retried with backoff while Elasticsearch is unavailable or rejecting requests (429s, also per
+        # document when its write queues are full), documents failing otherwise (eg mapping conflicts)
+        # are logged and dropped.  Once stopping a batch is given up after a few attempts, it is not
+        # acknowledged and so read again after a restart.
+
+        backoff, attempts = 1, 0
+        while len(batch) > 0:
+            attempts += 1
+            if attempts > 1:
+                if self.stopping and attempts > 3:
+                    logging.error('giving up on %d documents', len(batch) // 2)
+                    return False
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+
+            try:
+                resp = self.client.post('/_bulk', data=b'\n'.join(batch) + b'\n',
+                                        headers={'Content-Type': 'application/x-ndjson'},
+                                        params={'filter_path': 'errors,items.*.status,items.*.error'})
+            except requests.exceptions.RequestException as e:
+                logging.warning('bulk request failed: %s', e)
+                self.__count('request-failures', 1)
+                continue
+
+            if resp.status_code == 429 or resp.status_code >= 500:
+                logging.warning('bulk request rejected (%d), backing off %ds', resp.status_code, backoff)
+                self.__count('requests-rejected', 1)
+                continue
+
+            if resp.status_code != 200:
+                logging.error('bulk request failed (%d), dropping %d documents: %s',
+                              resp.status_code, len(batch) // 2, resp.text[:1000])
+                self.__count('dropped', len(batch) // 2)
+                return True
+
+            result = resp.json()
+            self.__count('requests', 1)
+            if not result.get('errors'):
+                self.__count('indexed', len(batch) // 2)
+                return True
+
+            retry, dropped = [], 0
+            for i, item in enumerate(result['items']):
+                status = item['index']['status']
+                if status == 429:
+                    retry += batch[2*i:2*i+2]
+                elif status >= 300:
+                    logging.error('document rejected (%d): %s', status, item['index'].get('error'))
+                    dropped += 1
+
+            self.__count('indexed', len(result['items']) - len(retry) // 2 - dropped)
+            self.__count('dropped', dropped)
+            if len(retry) > 0:
+                logging.warning('%d documents rejected (429), backing off %ds', len(retry) // 2, backoff)
+                self.__count('documents-rejected', len(retry) // 2)
+            batch = retry
+
+        return True
+
+
+    def close(self):
+        # Send whatever remains and wait for the requests in flight
+        self.flush()
+        for _ in self.__workers:
+            self.__queue.put(None)
+        for worker in self.__workers:
+            worker.join()
+
+
+class Checkpoint(evefile.Checkpoint):
+    def __init__(self, path, bulk):
+        # Read positions only become current once the lines before them are indexed, ie after a restart
+        # lines not acknowledged by Elasticsearch are read again (rather than lost)
+
+        evefile.Checkpoint.__init__(self, path)
+        self.bulk = bulk
+
+        # Acknowledgements arrive from the bulk threads (and may flush)
+        self.__lock = threading.RLock()
+
+
+    def update(self, reader):
+        self.bulk.mark((reader.inode, reader.offset), self.__acknowledged)
+
+
+    def __acknowledged(self, position):
+        with self.__lock:
+            self.set(*position)
+
+
+    def flush(self):
+        with self.__lock:
+            evefile.Checkpoint.flush(self)
+
+
+class Indexer(minimal.Parser):
+    def __init__(self, bulk, path='/var/log/suricata/eve.json', checkpoint=None):
+        # The minimal mode tailer, every line is indexed and alerts are passed to the elastic mode notifier
+
+        minimal.Parser.__init__(self, path, checkpoint)
+        self.name = 'Indexer'
+
+        self.bulk = bulk
+
+        # Prepended to the lines of each sensor when following several eve files, eg b'{"sensor":"eth0",'
+        self.__tags = {}
+
+
+    def make_checkpoint(self, path):
+        return Checkpoint(path, self.bulk)
+
+
+    def handle(self, line, stats, now, sensor=None):
+        if sensor is not None and line[:1] == b'{':
+            tag = self.__tags.get(sensor)
+            if tag is None:
+                tag = self.__tags[sensor] = b'{"sensor":' + json.dumps(sensor).encode() + b','
+            line = tag + line[1:]
+
+        self.bulk.add(line)
+
+        if evefile.event_type(line) == b'alert':
+            elastic.alert_queue.put(line)
+            stats['alerts'] += 1
+            try:
+                metrics.alert_queued(evefile.loads(line).get('timestamp'), now)
+            except ValueError:
+                pass
+
+
+    def idle(self, now):
+        self.bulk.tick()
+
+
+    def run(self):
+        try:
+            minimal.Parser.run(self)
+        finally:
+            # Record how far was indexed once the remaining lines are sent
+            self.bulk.close()
+            for checkpoint in self.checkpoints():
+                checkpoint.flush()
+
+
+def main_index(path='/var/log/suricata/eve.json', checkpoint=None, journal_path=None, urgent_severity=1, workers=2):
+    if journal_path is not None:
+        elastic.alert_queue.open(journal_path)
+
+    bulk = BulkWriter(workers=workers)
+
+    metrics.registry.gauge('alert_queue_depth', 'alerts pending (in memory and journaled)', elastic.alert_queue.qsize)
+    metrics.registry.gauge('bulk_queue_depth', 'batches waiting for a bulk worker', bulk.qsize)
+    indexer = Indexer(bulk, path, checkpoint); indexer.start()
+    notifier = elastic.Notifier(urgent_severity=urgent_severity); notifier.start()
+
+    # Gracefully stop on terminating signal
+
+    stopped = False
+
+    def stop(signum, frame):
+        nonlocal stopped
+        logging.info('received signal %s', signal.Signals(signum).name)
+        indexer.stop = True; bulk.stopping = True; indexer.join()
+        notifier.stop()
+        if notifier.is_alive():
+            elastic.alert_queue.join()
+        notifier.join()
+        stopped = True
+
+    for s in [signal.SIGINT, signal.SIGTERM]:
+        signal.signal(s, stop)
+
+    # Gracefully stop if any individual thread stops (unless already stopped by a signal)
+    while not stopped:
+        if not indexer.is_alive():
+            notifier.stop()
+            if notifier.is_alive():
+                elastic.alert_queue.join()
+            notifier.join()
+            break
+
+        if not notifier.is_alive():
+            indexer.stop = True; bulk.stopping = True; indexer.join()
+            for alert in elastic.alert_queue.spill():
+                logging.error('unhandled alert: %s', alert)
+            if elastic.alert_queue.path is not None:
+                logging.error('pending alerts saved to %s', elastic.alert_queue.path)
+            break
+
+        time.sleep(1)
@@ -0,0 +1,231 @@
+import metrics
+
+import collections
+import logging
+import os
+import queue
+import threading
+import time
+
+
+class SpillQueue:
+    def __init__(self, maxsize=10000, dumps=None, loads=None, refill_size=1000):
+        # Items are kept in memory up to maxsize, beyond that they are appended to the journal (once opened)
+        # and read back in order, otherwise put() blocks.  Items read from the journal are only removed
+        # from it once acknowledged, ie those not acknowledged are replayed after a restart.
+
+        self.maxsize = maxsize
+        self.dumps = dumps if dumps is not None else (lambda item: item)
+        self.loads = loads if loads is not None else (lambda line: line)
+        self.refill_size = refill_size
+
+        self.__cond = threading.Condition()
+        self.__done = threading.Condition(self.__cond)
+        self.__unfinished = 0
+
+        # Item, the journal offset after it (None if never journaled) and when queued (None if read from the journal)
+        self.__memory = collections.deque()
+
+        self.path = None
+        self.__fd = None
+        self.__spilled = 0    # Unread journal records
+        self.__read = 0       # Offset of the next unread journal record
+        self.__consumed = 0   # Offset after the last journal record returned by get()
+        self.__acked = 0      # Offset after the last acknowledged journal record
+        self.__size = 0
+
+        self.stats = metrics.registry.stats('journal')
+
+
+    def open(self, path):
+        with self.__cond:
+            self.path = path
+            self.__fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o600)
+            self.__size = os.fstat(self.__fd).st_size
+
+            try:
+                with open(path + '.ack') as file:
+                    self.__acked = int(file.read())
+            except FileNotFoundError:
+                self.__acked = 0
+            except ValueError as e:
+                logging.error('invalid journal ack file %s.ack: %s', path, e)
+                self.__acked = 0
+
+            if self.__acked > self.__size:
+                logging.error('journal %s shorter than acked offset, replaying all of it', path)
+                self.__acked = 0
+            self.__read = self.__consumed = self.__acked
+
+            # Count the records left over from a previous run
+            pending = 0
+            offset = self.__acked
+            while offset < self.__size:
+                data = os.pread(self.__fd, 1024*1024, offset)
+                pending += data.count(b'\n')
+                offset += len(data)
+
+            if pending > 0:
+                logging.info('replaying %d alerts from journal %s', pending, path)
+                self.__spilled = pending
+                self.__unfinished += pending
+                self.stats['replayed'] += pending
+                self.__cond.notify_all()
+
+
+    def qsize(self):
+        with self.__cond:
+            return len(self.__memory) + self.__spilled
+
+
+    def empty(self):
+        return self.qsize() == 0
+
+
+    def __append(self, items):
+        data = b''.join([self.dumps(item) + b'\n' for item in items])
+        os.write(self.__fd, data)
+        self.__size += len(data)
+        self.__spilled += len(items)
+        self.stats['spilled'] += len(items)
+
+
+    def put(self, item, block=True):
+        with self.__cond:
+            # None is used to stop consumers and is never journaled
+            if item is None:
+                self.__memory.append((item, None, None))
+
+            # Once spilling keep doing so until the journal is drained to preserve the order
+            elif self.__fd is not None and (self.__spilled > 0 or len(self.__memory) >= self.maxsize):
+                self.__append([item])
+
+            else:
+                if not block and len(self.__memory) >= self.maxsize:
+                    raise queue.Full
+                while len(self.__memory) >= self.maxsize:
+                    self.__cond.wait()
+                self.__memory.append((item, None, time.time()))
+
+            self.__unfinished += 1
+            self.__cond.notify_all()
+
+
+    def put_nowait(self, item):
+        self.put(item, block=False)
+
+
+    def __refill(self):
+        # Read the next journal records back into memory
+
+        while len(self.__memory) < self.refill_size and self.__spilled > 0:
+            data = os.pread(self.__fd, 1024*1024, self.__read)
+            end = data.rfind(b'\n')
+            if end == -1:
+                # A record larger than the read size
+                data = os.pread(self.__fd, self.__size - self.__read, self.__read)
+                end = data.find(b'\n')
+                if end == -1:
+                    logging.error('truncated journal record at offset %d', self.__read)
+                    self.__unfinished -= self.__spilled
+                    self.__spilled = 0
+                    break
+
+            for line in data[:end].split(b'\n'):
+                self.__read += len(line) + 1
+                self.__spilled -= 1
+
+                try:
+                    item = self.loads(line)
+                except Exception as e:
+                    logging.error('error processing journal line = %r: %s', line, e)
+                    self.__unfinished -= 1
+                    continue
+
+                self.__memory.append((item, self.__read, None))
+
+                if len(self.__memory) >= self.refill_size:
+                    break
+
+
+    def get(self, timeout=None):
+        return self.get_timed(timeout)[0]
+
+
+    def get_timed(self, timeout=None):
+        # Item and when it was queued (None if unknown, eg journaled)
+
+        with self.__cond:
+            deadline = None if timeout is None else time.monotonic() + timeout
+
+            while len(self.__memory) == 0:
+                if self.__spilled > 0:
+                    self.__refill()
+                    continue
+
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise queue.Empty
+                self.__cond.wait(remaining)
+
+            item, offset, queued = self.__memory.popleft()
+            if offset is not None:
+                self.__consumed = offset
+
+            self.__cond.notify_all()
+            return item, queued
+
+
+    def task_done(self):
+        with self.__cond:
+            self.__unfinished -= 1
+            if self.__unfinished <= 0:
+                self.__done.notify_all()
+
+
+    def join(self):
+        with self.__cond:
+            while self.__unfinished > 0:
+                self.__done.wait()
+
+
+    def ack(self):
+        # Everything returned by get() so far has been handled
+
+        with self.__cond:
+            if self.__fd is None or self.__consumed == self.__acked:
+                return
+
+            # Start over once everything journaled has been handled
+            if self.__consumed == self.__size and self.__spilled == 0 and \
+               all([offset is None for _, offset, _ in self.__memory]):
+                os.ftruncate(self.__fd, 0)
+                self.__size = self.__read = self.__consumed = 0
+
+            os.fsync(self.__fd)
+
+            tmppath = self.path + '.ack.tmp'
+            with open(tmppath, 'w') as file:
+                file.write(str(self.__consumed))
+            os.replace(tmppath, self.path + '.ack')
+
+            self.__acked = self.__consumed
+
+
+    def spill(self, unsent=[]):
+        # Move everything in memory to the journal (eg the consumer died) after the unsent items already taken
+        # from it, returns what could not be saved
+
+        with self.__cond:
+            items = list(unsent) + [item for item, offset, _ in self.__memory if offset is None and item is not None]
+            self.__memory.clear()
+            self.__unfinished = 0
+            self.__done.notify_all()
+            self.__cond.notify_all()
+
+            if self.__fd is None:
+                return items
+
+            self.__append(items)
+            os.fsync(self.__fd)
+            return []
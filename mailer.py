@@ -0,0 +1,107 @@
+import logging
+import smtplib
+import socket
+import threading
+
+
+class Transport:
+    def __init__(self, host='127.0.0.1', port=25, username=None, password=None, starttls=False,
+                 timeout=60, retries=None, backoff=1, max_backoff=300):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+
+        # Failed sends are retried with exponential backoff, indefinitely if retries is None (until closed),
+        # retries can be lowered while a send is in progress (eg when stopping)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.__smtp = None
+        self.__lock = threading.Lock()
+        self.__closed = threading.Event()
+
+
+    def __connect(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                smtp.ehlo()
+                smtp.starttls()
+                smtp.ehlo()
+            if self.username is not None:
+                smtp.login(self.username, self.password)
+        except:
+            smtp.close()
+            raise
+
+        logging.debug('connected to %s:%d', self.host, self.port)
+        return smtp
+
+
+    def __disconnect(self):
+        if self.__smtp is None:
+            return
+
+        try:
+            self.__smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self.__smtp.close()
+        self.__smtp = None
+
+
+    def __attempt(self, from_addr, to_addrs, msg):
+        # Reuse the session, a connection dropped while idle is reestablished without counting as a failure
+
+        if self.__smtp is not None:
+            try:
+                self.__smtp.sendmail(from_addr, to_addrs, msg)
+                return
+            except smtplib.SMTPServerDisconnected:
+                logging.debug('connection to %s:%d closed, reconnecting', self.host, self.port)
+                self.__smtp.close()
+                self.__smtp = None
+
+        self.__smtp = self.__connect()
+        self.__smtp.sendmail(from_addr, to_addrs, msg)
+
+
+    def send(self, from_addr, to_addrs, msg):
+        with self.__lock:
+            delay = self.backoff
+            attempt = 0
+
+            while True:
+                if self.__closed.is_set():
+                    raise smtplib.SMTPException('transport closed')
+
+                try:
+                    self.__attempt(from_addr, to_addrs, msg)
+                    return
+
+                except (smtplib.SMTPException, socket.timeout, OSError) as e:
+                    self.__disconnect()
+
+                    # Permanent failures (eg a rejected recipient or message) won't succeed on retry
+                    if isinstance(e, smtplib.SMTPRecipientsRefused) or \
+                       (isinstance(e, smtplib.SMTPResponseException) and 500 <= e.smtp_code < 600):
+                        raise
+
+                    attempt += 1
+                    if self.retries is not None and attempt > self.retries:
+                        raise
+
+                    logging.warning('send to %s:%d failed (attempt %d), retrying in %gs: %s',
+                                    self.host, self.port, attempt, delay, e)
+
+                    self.__closed.wait(delay)
+                    delay = min(delay * 2, self.max_backoff)
+
+
+    def close(self):
+        self.__closed.set()
+        with self.__lock:
+            self.__disconnect()
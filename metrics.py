@@ -0,0 +1,228 @@
+import evetime
+
+import bisect
+import collections
+import http.server
+import logging
+import os
+import socketserver
+import threading
+
+
+class Histogram:
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = sorted(buckets)
+
+        # Observations are not on the hot path (eg per alert or mail), shared between threads
+        self.__lock = threading.Lock()
+        self.__counts = [0] * (len(self.buckets) + 1)
+        self.__sum = 0
+        self.__count = 0
+
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.__lock:
+            self.__counts[i] += 1
+            self.__sum += value
+            self.__count += 1
+
+
+    def mean(self):
+        with self.__lock:
+            return self.__sum / self.__count if self.__count > 0 else None
+
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the quantile (inf if beyond the last), None if empty
+        with self.__lock:
+            counts, count = list(self.__counts), self.__count
+        if count == 0:
+            return None
+
+        cumulative = 0
+        for bound, n in zip(self.buckets + [float('inf')], counts):
+            cumulative += n
+            if cumulative >= q * count:
+                return bound
+
+
+    def render(self):
+        with self.__lock:
+            counts, total, count = list(self.__counts), self.__sum, self.__count
+
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        cumulative = 0
+        for bound, n in zip(self.buckets + ['+Inf'], counts):
+            cumulative += n
+            lines += [f'{self.name}_bucket{{le="{bound}"}} {cumulative}']
+        lines += [f'{self.name}_sum {total}', f'{self.name}_count {count}']
+        return lines
+
+
+class Registry:
+    def __init__(self, prefix='frosty'):
+        self.prefix = prefix
+
+        self.__lock = threading.Lock()
+        self.__stats = []
+        self.__logged = {}
+        self.__callbacks = {}
+        self.__histograms = {}
+
+
+    def stats(self, subsystem):
+        # Counters for one thread, a plain dict updated as before (ie nothing added to the hot path, a dict
+        # subclass would be slower) and never reset.  Read when scraped by copying (a single dict operation
+        # hence atomic), those of the same subsystem are summed.
+
+        stats = collections.defaultdict(int)
+        with self.__lock:
+            self.__stats += [(subsystem, stats)]
+        return stats
+
+
+    def log(self, stats):
+        # Changes since the previous call for the same stats (ie the hourly stats log)
+
+        current = dict(stats)
+        with self.__lock:
+            previous = self.__logged.get(id(stats), {})
+            self.__logged[id(stats)] = current
+
+        changed = {k: v - previous.get(k, 0) for k, v in current.items() if v != previous.get(k, 0)}
+        if len(changed) > 0:
+            logging.info('stats: %s', ', '.join(['%s = %d' % (k, changed[k]) for k in sorted(changed.keys())]))
+
+
+    def gauge(self, name, help, func):
+        # Evaluated when scraped, eg queue depths
+        with self.__lock:
+            self.__callbacks[f'{self.prefix}_{name}'] = ('gauge', help, func)
+
+
+    def counter(self, name, help, func):
+        # Evaluated when scraped, eg totals already kept elsewhere
+        with self.__lock:
+            self.__callbacks[f'{self.prefix}_{name}_total'] = ('counter', help, func)
+
+
+    def histogram(self, name, help, buckets):
+        name = f'{self.prefix}_{name}'
+        with self.__lock:
+            if name not in self.__histograms:
+                self.__histograms[name] = Histogram(name, help, buckets)
+            return self.__histograms[name]
+
+
+    def totals(self):
+        # Stats counters by metric name, eg frosty_parser_lines_read_total
+
+        with self.__lock:
+            stats = list(self.__stats)
+
+        counters = collections.defaultdict(int)
+        for subsystem, s in stats:
+            for key, value in dict(s).items():
+                counters[f"{self.prefix}_{subsystem}_{key.replace('-', '_')}_total"] += value
+        return counters
+
+
+    def render(self):
+        # Prometheus text format
+        # Ref: https://prometheus.io/docs/instrumenting/exposition_formats/
+
+        counters = self.totals()
+        with self.__lock:
+            callbacks = dict(self.__callbacks)
+            histograms = list(self.__histograms.values())
+
+        lines = []
+        for name in sorted(counters.keys()):
+            lines += [f'# TYPE {name} counter', f'{name} {counters[name]}']
+
+        for name in sorted(callbacks.keys()):
+            kind, help, func = callbacks[name]
+            try:
+                value = func()
+            except Exception as e:
+                logging.warning('unable to evaluate %s: %s', name, e)
+                continue
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} {kind}', f'{name} {value}']
+
+        for histogram in histograms:
+            lines += histogram.render()
+
+        return ('\n'.join(lines) + '\n').encode()
+
+
+registry = Registry()
+
+LATENCY_BUCKETS = [0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, 1800, 3600]
+
+# Shared by the modes, alerts read back from the journal (ie after a restart) are not included in the latter
+queued_latency = registry.histogram('alert_queued_latency_seconds', 'eve timestamp to queued for mailing',
+                                    LATENCY_BUCKETS)
+mailed_latency = registry.histogram('alert_mailed_latency_seconds', 'queued to accepted by the mail server',
+                                    LATENCY_BUCKETS)
+
+
+def alert_queued(timestamp, now):
+    # Eve timestamp of a queued alert, ignored if missing or invalid
+    try:
+        queued_latency.observe(now - evetime.parse(timestamp).timestamp())
+    except (TypeError, ValueError):
+        pass
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+
+        body = registry.render()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class Server(threading.Thread):
+    def __init__(self, address='127.0.0.1:9108'):
+        # Serves /metrics on host:port or a unix socket path (eg /run/frosty/metrics.sock),
+        # a daemon thread as there is nothing to finish when stopping
+
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.name = 'Metrics'
+
+        if '/' in address:
+            if os.path.exists(address):
+                os.unlink(address)
+            self.httpd = UnixHTTPServer(address, Handler)
+        else:
+            host, port = address.rsplit(':', maxsplit=1)
+            self.httpd = http.server.ThreadingHTTPServer((host, int(port)), Handler)
+
+        logging.info('serving metrics on %s', address)
+
+
+    def run(self):
+        self.httpd.serve_forever()
+
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -1,175 +1,539 @@
 import inotify.adapters
+import inotify.constants
+
+import batching
+import digest
+import evefile
+import flowtable
+import journal
+import mailer
+import metrics
+import topk
 
 import collections
+import fnmatch
+import glob
 import json
 import logging
 import os
-import queue
 import signal
-import smtplib
 import sys
 import threading
 import time
 
 
-alert_queue = queue.Queue()
+# Bounded, spills to the journal (when opened) under pressure
+alert_queue = journal.SpillQueue(dumps=lambda r: json.dumps(r, separators=(',', ':')).encode(), loads=evefile.loads)
+
+
+def sensor_name(pattern, path):
+    # The part of path matched by the wildcards of pattern, eg eth0 for /var/log/suricata/*/eve.json or
+    # /var/log/suricata/eve-*.json, None if pattern is a plain path
+    if not glob.has_magic(pattern):
+        return None
+    first = min([pattern.index(c) for c in '*?[' if c in pattern])
+    last = max([pattern.rindex(c) for c in '*?]' if c in pattern])
+    return path[first:len(path) - (len(pattern) - last - 1)]
+
+
+class Tail:
+    def __init__(self, path, sensor=None, checkpoint=None):
+        # A followed file, its reader holds the read position and any partial line carried forward
+        self.path = path
+        self.sensor = sensor
+        self.checkpoint = checkpoint
+        self.reader = None
+
+        # Inodes of the recently rotated files read to the end, so that none is read twice
+        self.finished = collections.deque(maxlen=16)
 
 
 class Parser(threading.Thread):
-    def __init__(self):
+    def __init__(self, path='/var/log/suricata/eve.json', checkpoint=None, flows=None, scan_interval=10):
         threading.Thread.__init__(self)
         self.daemon = False
         self.name = 'Parser'
 
+        # A file or a glob of them (eg /var/log/suricata/*/eve.json for several suricata instances), followed
+        # through a single inotify instance watching their directories.  With a glob alerts are tagged with
+        # the sensor (the part of the path matched by the wildcards) and each file has its own checkpoint
+        # (the checkpoint path suffixed with the sensor).  Files appearing later are followed from the start.
+        self.path = path
+        self.checkpoint = checkpoint
+        self.scan_interval = scan_interval
         self.stop = False
 
+        # Flow context (hostname, bytes, duration) tracked for enriching alerts
+        self.flows = flows
 
-    def run(self):
-        open_evefile = lambda: open('/var/log/suricata/eve.json', 'r', encoding='utf-8')
-        start_inotifier = lambda path: inotify.adapters.Inotify(paths=[path])
+        # Approximate bytes per tracked flow, sampled on this thread (the only one the table can be iterated on)
+        # for the metrics gauge
+        self.flow_memory = 0
+        self.__sampled = None
+
+        self.__tails = {}
+        self.__inotifier = None
+        self.__watched = set()
+
+        # Rotated files still read (by rotated path, or followed path and inode until the new name is seen)
+        # until closed by the writer or idle, eg suricata writes to the renamed file until it reopens on HUP.
+        # Renames are paired by the inotify cookie.
+        self.__rotated = {}
+        self.__moves = {}
+        self.__scanned = None
+        self.__logged = None
+
+
+    def make_checkpoint(self, path):
+        # Overridden by the modes only recording positions once processed (eg indexer.Indexer)
+        return evefile.Checkpoint(path)
+
+
+    def checkpoints(self):
+        return [tail.checkpoint for tail in self.__tails.values() if tail.checkpoint is not None]
+
+
+    def handle(self, line, stats, now, sensor=None):
+        # Per line processing, overridden by the modes reusing the tailer (eg indexer.Indexer)
+
+        t = evefile.event_type(line)
+        if self.flows is not None and t in flowtable.EVENT_TYPES:
+            self.flows.update(t, line, now)
+            stats['flow-events'] += 1
+
+        else:
+            record = evefile.parse_alert(line, stats, t)
+            if record is not None:
+                if sensor is not None:
+                    record['sensor'] = sensor
+                alert_queue.put(record)
+                stats['alerts'] += 1
+                metrics.alert_queued(record.get('timestamp'), now)
+
+
+    def idle(self, now):
+        # Called once everything available has been processed and about every second while waiting
+
+        if self.flows is not None:
+            self.flows.expire(now)
+            if self.flows.talkers is not None:
+                self.flows.talkers.maybe_save(now)
+
+            if self.__sampled is None or now - self.__sampled >= 1:
+                self.flow_memory = self.flows.memory()
+                self.__sampled = now
+
+
+    def __drain(self, tail, stats, reader=None):
+        # Process everything currently available
+
+        reader = tail.reader if reader is None else reader
+        if reader is None:
+            return
+
+        # While rotated files are still read the checkpoint stays on them, ie after a restart the current file
+        # is read again from the start rather than the rest of the rotated ones lost
+        checkpoint = tail.checkpoint
+        if reader is tail.reader and any([r[0] is tail for r in self.__rotated.values()]):
+            checkpoint = None
+
+        count, oversized = 0, reader.oversized
+        now = time.time()
+        for line in reader.lines():
+            logging.debug('line = %r', line)
+            stats['lines-read'] += 1
+
+            self.handle(line, stats, now, tail.sensor)
+
+            if self.stop:
+                break
+
+            # Keep the checkpoint current during large catch-ups
+            count += 1
+            if checkpoint is not None and count % 10000 == 0:
+                checkpoint.update(reader)
+
+        if checkpoint is not None:
+            checkpoint.update(reader)
+
+        self.idle(now)
+
+        if reader.oversized > oversized:
+            logging.warning('%d oversized lines dropped', reader.oversized - oversized)
+            stats['oversized'] += reader.oversized - oversized
+
+        # Incomplete lines are carried forward and completed on a later event
+        if reader.partial():
+            stats['incomplete'] += 1
+
+
+    def __resume(self, tail, stats, new=False):
+        # Open the file and resume from the checkpoint, if there is none start from the end
+        # (or the start for files appearing while running)
+
+        tail.reader = evefile.EveReader(tail.path)
+
+        saved = tail.checkpoint.load() if tail.checkpoint is not None else None
+        if saved is None:
+            if not new:
+                tail.reader.seek_end()
+            return
+
+        inode, offset = saved
+        if inode == tail.reader.inode:
+            if offset <= tail.reader.size():
+                logging.info('resuming %s from offset %d', tail.path, offset)
+                tail.reader.seek(offset)
+            else:
+                logging.warning('%s truncated, reading from the start', tail.path)
+            return
+
+        # The file was rotated while not running, finish the rotated file first
+        rotated = evefile.find_rotated(tail.path, inode)
+        if rotated is None:
+            logging.warning('checkpointed file not found (inode %d), reading %s from the start', inode, tail.path)
+            return
 
-        evefile = open_evefile()
-        evefile.seek(0, os.SEEK_END)
-        inotifier = start_inotifier(evefile.name)
+        logging.info('catching up on %s from offset %d', rotated, offset)
+        old = evefile.EveReader(rotated)
+        old.seek(offset)
+        self.__drain(tail, stats, old)
+        old.close()
 
-        stats = collections.defaultdict(int)
-        last = time.time()
+
+    def __scan(self, stats, new=False):
+        # Watch the directories and follow the files (matching the glob) not yet followed
+
+        mask = inotify.constants.IN_MODIFY | inotify.constants.IN_CLOSE_WRITE | inotify.constants.IN_CREATE | \
+               inotify.constants.IN_DELETE | inotify.constants.IN_MOVED_FROM | inotify.constants.IN_MOVED_TO
+
+        for directory in glob.glob(os.path.dirname(self.path) or '.'):
+            if directory not in self.__watched and os.path.isdir(directory):
+                self.__inotifier.add_watch(directory, mask)
+                self.__watched.add(directory)
+
+        for path in sorted(glob.glob(self.path)):
+            if path in self.__tails or not os.path.isfile(path):
+                continue
+
+            sensor = sensor_name(self.path, path)
+            checkpoint = None
+            if self.checkpoint is not None:
+                checkpoint = self.make_checkpoint(self.checkpoint if sensor is None else
+                                                  self.checkpoint + '.' + sensor.replace('/', '_'))
+
+            tail = Tail(path, sensor, checkpoint)
+            try:
+                self.__resume(tail, stats, new)
+            except FileNotFoundError:
+                continue
+            self.__tails[path] = tail
+            stats['files'] += 1
+
+            if sensor is not None:
+                logging.info('following %s (sensor %s)', path, sensor)
+
+            # Catch up on anything written while not running
+            self.__drain(tail, stats)
+
+        if not new and len(self.__tails) == 0:
+            logging.warning('no files matching %s, waiting', self.path)
+
+
+    def __reopen(self, tail, stats):
+        # A new file at the path (or possibly the same one reopened), finish the old one before switching
+
+        self.__drain(tail, stats)
+
+        try:
+            reader = evefile.EveReader(tail.path)
+        except FileNotFoundError:
+            # Renamed or removed, read once recreated
+            return
+
+        if tail.reader is not None and reader.inode == tail.reader.inode:
+            reader.close()
+            return
+
+        logging.info('%s rotated, reopening file', tail.path)
+
+        # Renamed (its new name not seen yet) or removed, read until its new name is seen or idle
+        if tail.reader is not None:
+            self.__rotated[(tail.path, tail.reader.inode)] = [tail, tail.reader, time.monotonic()]
+        tail.reader = reader
+        stats['reopens'] += 1
+
+        self.__drain(tail, stats)
+
+
+    def __moved(self, path, cookie, stats):
+        # A followed (or rotated) file renamed to path, eg eve.json to eve.json.1
+
+        tail, reader = self.__moves.pop(cookie)
+        try:
+            inode = os.stat(path).st_ino
+        except FileNotFoundError:
+            inode = None
+
+        # A rotated file renamed again (eg eve.json.1 to eve.json.2)
+        if reader is not None:
+            self.__finish(path, stats)
+            self.__rotated[path] = [tail, reader, time.monotonic()]
+            return
+
+        if path in self.__rotated and self.__rotated[path][1].inode == inode:
+            return
+        self.__finish(path, stats)
+
+        # Already switched from (ie the new file was followed before the rename was seen)
+        unnamed = self.__rotated.pop((tail.path, inode), None)
+        if unnamed is not None:
+            self.__rotated[path] = unnamed
+            return
+
+        if inode is None or inode in tail.finished:
+            return
+
+        # The followed file, kept being read while the new one is followed
+        if tail.reader is not None and inode == tail.reader.inode:
+            self.__rotated[path] = [tail, tail.reader, time.monotonic()]
+            tail.reader = None
+            self.__reopen(tail, stats)
+            return
+
+        # Rotated before being opened (ie while more than a rotation behind), read all of it
+        logging.warning('catching up on %s', path)
+        stats['rotations-caught-up'] += 1
+        try:
+            reader = evefile.EveReader(path)
+        except FileNotFoundError:
+            return
+        self.__rotated[path] = [tail, reader, time.monotonic()]
+        self.__drain(tail, stats, reader)
+
+
+    def __finish(self, path, stats):
+        # Read a rotated file to the end and stop following it
+
+        rotated = self.__rotated.pop(path, None)
+        if rotated is None:
+            return
+
+        tail, reader, _ = rotated
+        self.__drain(tail, stats, reader)
+        tail.finished.append(reader.inode)
+        reader.close()
+
+
+    def __periodic(self, stats):
+        # Called about every second whether or not there are events
+
+        self.idle(time.time())
+
+        # Rotated files no longer written to (without having been closed, eg by a writer that stopped)
+        for path, rotated in list(self.__rotated.items()):
+            offset = rotated[1].offset
+            self.__drain(rotated[0], stats, rotated[1])
+            if rotated[1].offset != offset:
+                rotated[2] = time.monotonic()
+            elif time.monotonic() - rotated[2] >= 30:
+                self.__finish(path, stats)
+
+        # Renames whose destination is outside the watched directories
+        if len(self.__moves) > 1000:
+            self.__moves.clear()
+
+        # Pick up new directories (eg of a new sensor) and any missed files
+        if time.monotonic() - self.__scanned >= self.scan_interval:
+            self.__scan(stats, new=True)
+            self.__scanned = time.monotonic()
+
+        if time.time() - self.__logged >= 3600:
+            if self.flows is not None:
+                logging.info('flows: %d tracked (about %d bytes each), %d evicted, %d expired',
+                             len(self.flows), self.flows.memory(), self.flows.evicted, self.flows.expired)
+            metrics.registry.log(stats)
+            self.__logged = time.time()
+
+
+    def run(self):
+        stats = metrics.registry.stats(self.name.lower())
+        self.__logged = time.time()
+
+        self.__inotifier = inotify.adapters.Inotify()
+        self.__scan(stats)
+        self.__scanned = time.monotonic()
 
         while not self.stop:
-            reopen, restart = False, False
-            for event in inotifier.event_gen(timeout_s=1):
+            for event in self.__inotifier.event_gen(timeout_s=1):
                 if event is None:
+                    self.__periodic(stats)
+                    if self.stop:
+                        break
                     continue
                 logging.debug('event = %r', event)
 
-                _, types, _, _ = event
+                header, types, directory, filename = event
+                path = os.path.join(directory, filename)
+                tail = self.__tails.get(path)
+
                 for t in types:
+                    if tail is not None:
+                        # If the file is modified (or closed) drain everything available
+                        if t in ['IN_MODIFY', 'IN_CLOSE_WRITE', 'IN_DELETE']:
+                            self.__drain(tail, stats)
 
-                    # If the file is modified read lines until eof
-                    if t == 'IN_MODIFY':
-                        while not self.stop:
-                            pos = evefile.tell()
-                            line = evefile.readline()
-                            if line == '':
-                                break
+                        # Renamed (eg by log rotation), followed to its new name
+                        elif t == 'IN_MOVED_FROM':
+                            self.__drain(tail, stats)
+                            self.__moves[header.cookie] = (tail, None)
 
-                            # Handle incomplete lines
-                            if isinstance(line, bytes) or not line.endswith('\n'):
-                                evefile.seek(pos)
-                                time.sleep(0.1)
-                                stats['incomplete'] += 1
-                                continue
+                        # Recreated
+                        elif t in ['IN_CREATE', 'IN_MOVED_TO']:
+                            self.__reopen(tail, stats)
 
-                            logging.debug('line = %r', line)
-                            stats['lines-read'] += 1
+                    elif t == 'IN_MOVED_TO' and header.cookie in self.__moves:
+                        self.__moved(path, header.cookie, stats)
 
-                            try:
-                                record = json.loads(line)
-                            except Exception as e:
-                                logging.error('error processing line = %r: %s', line, e)
-                                stats['bad-json'] += 1
-                                break
+                    elif path in self.__rotated:
+                        rotated = self.__rotated[path]
+                        if t == 'IN_MODIFY':
+                            self.__drain(rotated[0], stats, rotated[1])
+                            rotated[2] = time.monotonic()
 
-                            if record.get('event_type') == 'alert':
-                                alert_queue.put(record)
-                                stats['alerts'] += 1
+                        # Renamed again (eg eve.json.1 to eve.json.2)
+                        elif t == 'IN_MOVED_FROM':
+                            self.__drain(rotated[0], stats, rotated[1])
+                            self.__rotated.pop(path)
+                            self.__moves[header.cookie] = (rotated[0], rotated[1])
 
-                            break
+                        # Closed by the writer (eg suricata reopening on HUP) or removed
+                        elif t in ['IN_CLOSE_WRITE', 'IN_DELETE']:
+                            self.__finish(path, stats)
 
-                    elif t in ['IN_CLOSE_WRITE', 'IN_DELETE_SELF', 'IN_MOVE_SELF', 'IN_IGNORED']:
-                        reopen = True
-                        if t == 'IN_IGNORED':
-                            restart = True
+                    # A new file (possibly matching the glob) or a watched directory removed
+                    elif t in ['IN_CREATE', 'IN_MOVED_TO'] and fnmatch.fnmatchcase(path, self.path):
+                        self.__scan(stats, new=True)
+                    elif t == 'IN_IGNORED':
+                        self.__watched.discard(directory)
 
-            if reopen:
-                logging.info('detected file write (eg log rotation), reopening file')
+                if self.stop:
+                    break
 
-                evefile.close()
-                evefile = open_evefile()
-                stats['reopens'] += 1
+            self.__periodic(stats)
 
-                if restart:
-                    inotifier = start_inotifier(evefile.name)
-                    stats['restarts'] += 1
+        # The rest of any rotated files still read is read after a restart (the checkpoint is left on them)
+        for _, reader, _ in self.__rotated.values():
+            reader.close()
 
-            if len(stats) > 0 and time.time() - last >= 3600:
-                logging.info('stats: %s', ', '.join(['%s = %d' % (k, stats[k]) for k in sorted(stats.keys())]))
-                stats = collections.defaultdict(int)
-                last = time.time()
+        for tail in self.__tails.values():
+            if tail.checkpoint is not None:
+                tail.checkpoint.flush()
+            if tail.reader is not None:
+                tail.reader.close()
 
-        evefile.close()
+        if self.flows is not None and self.flows.talkers is not None:
+            self.flows.talkers.save(time.time())
 
 
 class Notifier(threading.Thread):
-    def __init__(self):
+    def __init__(self, urgent_severity=1, transport=None, flows=None, window=300):
         threading.Thread.__init__(self)
         self.daemon = False
         self.name = 'Notifier'
 
-        self.stop = False
+        self.flows = flows
+
+        self.__transport = transport if transport is not None else mailer.Transport('127.0.0.1')
+        self.__batcher = batching.Batcher(alert_queue, window=window, urgent_severity=urgent_severity)
 
 
     def run(self):
-        def mail_alerts(alerts):
-            body = 'Subject: suricata alerts\r\nFrom: frosty@localhost\r\n'
-            body += '\n'.join([json.dumps(a, indent=4) for a in alerts])
+        def mail_alerts(aggregator):
+            count = len(aggregator)
+            entries, overflow, dropped = aggregator.flush()
 
-            smtp = smtplib.SMTP('127.0.0.1')
-            smtp.sendmail('frosty@localhost', 'root@localhost', body)
-            smtp.quit()
+            # Enriched when sent rather than when queued so that the flow has likely ended by then
+            if self.flows is not None:
+                for entry in entries:
+                    context = self.flows.lookup(entry['flow_id'])
+                    if context is not None:
+                        entry['flow'] = context
 
-            logging.info('sent mail with %d alerts', len(alerts))
+            # Compact summary in the body (size capped) with the entries and sample records attached
+            message = digest.render('suricata alerts', 'frosty@localhost', 'root@localhost',
+                                    count, entries, overflow, dropped)
+            self.__transport.send('frosty@localhost', 'root@localhost', message)
 
-        last = time.time()
+            logging.info('sent mail with %d alerts in %d entries (%d bytes)', count, len(entries), len(message))
 
-        while not self.stop:
-            if not alert_queue.empty() and time.time() - last >= 300:
-                alerts = []
-                while not alert_queue.empty():
-                    alerts += [alert_queue.get()]
-                    alert_queue.task_done()
+        self.__batcher.run(mail_alerts)
+        self.__transport.close()
 
-                mail_alerts(alerts)
-                last = time.time()
 
-            time.sleep(1)
+    def stop(self):
+        # Don't retry failed sends indefinitely once stopping, unsent journaled alerts are resent on restart
+        self.__transport.retries = 3
+        self.__batcher.stop()
 
-        if not alert_queue.empty():
-            alerts = []
-            while not alert_queue.empty():
-                alerts += [alert_queue.get()]
-                alert_queue.task_done()
 
-            mail_alerts(alerts)
+def main_minimal(path='/var/log/suricata/eve.json', checkpoint=None, journal_path=None, urgent_severity=1,
+                 max_flows=0, top_talkers=None):
+    if journal_path is not None:
+        alert_queue.open(journal_path)
 
+    flows = None
+    if max_flows > 0:
+        talkers = topk.TopTalkers(top_talkers) if top_talkers is not None else None
+        flows = flowtable.FlowTable(max_flows, talkers=talkers)
+    elif top_talkers is not None:
+        logging.warning('top talkers require flow tracking, not counted')
 
-def main_minimal():
-    parser = Parser(); parser.start()
-    notifier = Notifier(); notifier.start()
+    parser = Parser(path, checkpoint=checkpoint, flows=flows)
+
+    # Evaluated on the metrics server thread, hence only values that are safe to read from it
+    metrics.registry.gauge('alert_queue_depth', 'alerts pending (in memory and journaled)', alert_queue.qsize)
+    if flows is not None:
+        metrics.registry.gauge('flows', 'flows tracked', lambda: len(flows))
+        metrics.registry.gauge('flow_memory_bytes', 'approximate bytes per tracked flow', lambda: parser.flow_memory)
+        metrics.registry.counter('flows_evicted', 'flows dropped before timing out', lambda: flows.evicted)
+        metrics.registry.counter('flows_expired', 'flows timed out', lambda: flows.expired)
+
+    parser.start()
+    notifier = Notifier(urgent_severity=urgent_severity, flows=flows); notifier.start()
 
     # Gracefully stop on terminating signal
 
+    stopped = False
+
     def stop(signum, frame):
+        nonlocal stopped
         logging.info('received signal %s', signal.Signals(signum).name)
         parser.stop = True; parser.join()
-        notifier.stop = True; alert_queue.join(); notifier.join()
+        notifier.stop()
+        if notifier.is_alive():
+            alert_queue.join()
+        notifier.join()
+        stopped = True
 
     for s in [signal.SIGINT, signal.SIGTERM]:
         signal.signal(s, stop)
 
-    # Gracefully stop if any individual thread stops
-
-    while True:
+    # Gracefully stop if any individual thread stops (unless already stopped by a signal)
+    while not stopped:
         if not parser.is_alive():
-            notifier.stop = True; alert_queue.join(); notifier.join()
+            notifier.stop()
+            if notifier.is_alive():
+                alert_queue.join()
+            notifier.join()
             break
 
         if not notifier.is_alive():
             parser.stop = True; parser.join()
-            while not alert_queue.empty():
-                alert = alert_queue.get()
-                alert_queue.task_done()
+            for alert in alert_queue.spill():
                 logging.error('unhandled alert: %s', alert)
+            if alert_queue.path is not None:
+                logging.error('pending alerts saved to %s', alert_queue.path)
             break
 
         time.sleep(1)
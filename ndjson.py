@@ -0,0 +1,95 @@
+class Framer:
+    def __init__(self, max_record_size=16*1024*1024):
+        self.max_record_size = max_record_size
+
+        self.__tail = bytearray()
+        self.__discarding = False
+        self.__skipped = 0    # Bytes of the record being discarded, consumed once its newline is seen
+
+        # Bytes of complete (yielded or skipped) records including newlines
+        self.consumed = 0
+        self.oversized = 0
+
+
+    def reset(self):
+        self.__tail.clear()
+        self.__discarding = False
+        self.__skipped = 0
+        self.consumed = 0
+
+
+    def partial(self):
+        return len(self.__tail) > 0 or self.__discarding
+
+
+    def __append(self, view):
+        # Buffer a partial record, dropping it once it exceeds the maximum size
+
+        if self.__discarding:
+            self.__skipped += len(view)
+            return
+
+        if len(self.__tail) + len(view) > self.max_record_size:
+            self.__skipped = len(self.__tail) + len(view)
+            self.__tail.clear()
+            self.__discarding = True
+            self.oversized += 1
+            return
+
+        self.__tail += view
+
+
+    def feed(self, data, size=None):
+        # Yield the complete records (without the newline) from data[:size],
+        # each byte is copied at most once into the partial record buffer and once out of it
+
+        if size is None:
+            size = len(data)
+        view = memoryview(data)
+        start = 0
+
+        # Complete the partial record carried forward from the previous feed
+        if self.__tail or self.__discarding:
+            end = data.find(b'\n', 0, size)
+            if end == -1:
+                self.__append(view[:size])
+                return
+
+            self.__append(view[:end])
+            self.consumed += 1
+            start = end + 1
+
+            if self.__discarding:
+                self.consumed += self.__skipped
+                self.__skipped = 0
+                self.__discarding = False
+            else:
+                record = bytes(self.__tail)
+                self.__tail.clear()
+                self.consumed += len(record)
+                if record:
+                    yield record
+
+        end = data.rfind(b'\n', start, size)
+        if end == -1:
+            self.__append(view[start:size])
+            return
+
+        records = bytes(view[start:end]).split(b'\n')
+
+        # Only check the individual record sizes when needed
+        if max(map(len, records)) <= self.max_record_size:
+            for record in records:
+                self.consumed += len(record) + 1
+                if record:
+                    yield record
+        else:
+            for record in records:
+                self.consumed += len(record) + 1
+                if len(record) > self.max_record_size:
+                    self.oversized += 1
+                elif record:
+                    yield record
+
+        if end + 1 < size:
+            self.__append(view[end+1:size])
@@ -0,0 +1,96 @@
+import evefile
+import evetime
+import minimal
+
+import collections
+import concurrent.futures
+import gzip
+import heapq
+import logging
+import os
+
+
+def timestamp_key(record):
+    try:
+        return evetime.parse(record['timestamp']).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return 0.0
+
+
+def split(paths, chunk_size):
+    # Split plain files into byte ranges, compressed files can only be processed whole
+
+    for path in paths:
+        if path.endswith('.gz'):
+            yield path, 0, None
+            continue
+
+        size = os.path.getsize(path)
+        for start in range(0, size, chunk_size):
+            yield path, start, min(start + chunk_size, size)
+
+
+def extract(path, start, end):
+    # Extract the alerts from lines starting within [start, end), sorted by timestamp
+
+    stats = collections.defaultdict(int)
+    alerts = []
+
+    if path.endswith('.gz'):
+        reader = evefile.EveReader(path, file=gzip.open(path, 'rb'))
+    else:
+        reader = evefile.EveReader(path)
+
+        # A line straddling the start belongs to the previous range
+        if start > 0:
+            with open(path, 'rb') as file:
+                file.seek(start - 1)
+                file.readline()
+                start = file.tell()
+            reader.seek(start)
+
+    for line in reader.lines():
+        if end is not None and reader.offset - len(line) - 1 >= end:
+            break
+
+        stats['lines-read'] += 1
+        record = evefile.parse_alert(line, stats)
+        if record is not None:
+            alerts += [(timestamp_key(record), record)]
+            stats['alerts'] += 1
+
+    reader.close()
+
+    alerts.sort(key=lambda a: a[0])
+    return alerts, dict(stats)
+
+
+def main_replay(paths, workers=None, chunk_size=64*1024*1024):
+    # Send in size bounded batches rather than a mail per high severity alert
+    notifier = minimal.Notifier(urgent_severity=0); notifier.start()
+
+    # The notifier is stopped (after sending what was queued) even if a file can't be read, eg missing or truncated
+    try:
+        stats = collections.defaultdict(int)
+        results = []
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(extract, *chunk) for chunk in split(paths, chunk_size)]
+            logging.info('replaying %d files in %d chunks', len(paths), len(futures))
+
+            for future in futures:
+                alerts, chunk_stats = future.result()
+                results += [alerts]
+                for k, v in chunk_stats.items():
+                    stats[k] += v
+
+        for _, record in heapq.merge(*results, key=lambda a: a[0]):
+            minimal.alert_queue.put(record)
+
+        logging.info('stats: %s', ', '.join(['%s = %d' % (k, stats[k]) for k in sorted(stats.keys())]))
+
+    finally:
+        notifier.stop()
+        if notifier.is_alive():
+            minimal.alert_queue.join()
+        notifier.join()
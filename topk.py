@@ -0,0 +1,173 @@
+import heapq
+import json
+import logging
+import os
+import time
+
+
+class SpaceSaving:
+    def __init__(self, k=1000):
+        # Approximate heaviest keys in bounded memory (the space saving algorithm): at most k keys are
+        # counted, a new key replaces the smallest one and inherits its count (as the error bound).
+        # Counts are overestimates by at most their error, any key weighing more than 1/k of the total
+        # is present.
+        # Ref: https://www.cs.ucsb.edu/sites/default/files/documents/2005-23.pdf
+
+        self.k = k
+        self.__counters = {}
+
+        # Pairs of count and key, counts of keys incremented since being pushed are stale (too low)
+        # and are refreshed when they reach the top
+        self.__heap = []
+
+
+    def __len__(self):
+        return len(self.__counters)
+
+
+    def add(self, key, weight=1):
+        counter = self.__counters.get(key)
+        if counter is not None:
+            counter[0] += weight
+            return
+
+        if len(self.__counters) < self.k:
+            self.__counters[key] = [weight, 0]
+            heapq.heappush(self.__heap, (weight, key))
+            return
+
+        while True:
+            count, victim = self.__heap[0]
+            current = self.__counters[victim][0]
+            if current == count:
+                break
+            heapq.heapreplace(self.__heap, (current, victim))
+
+        del self.__counters[victim]
+        self.__counters[key] = [count + weight, count]
+        heapq.heapreplace(self.__heap, (count + weight, key))
+
+
+    def items(self):
+        # Triples of key, count and error by descending count
+        return sorted([(key, c[0], c[1]) for key, c in self.__counters.items()], key=lambda i: i[1], reverse=True)
+
+
+    @staticmethod
+    def load(items, k=1000):
+        summary = SpaceSaving(k)
+        for key, count, error in items[:k]:
+            summary.__counters[key] = [count, error]
+        summary.__heap = [(c[0], key) for key, c in summary.__counters.items()]
+        heapq.heapify(summary.__heap)
+        return summary
+
+
+def merge(summaries):
+    # Combined counts and errors of summaries (eg of consecutive periods) by descending count
+    merged = {}
+    for items in summaries:
+        for key, count, error in items:
+            c = merged.setdefault(key, [0, 0])
+            c[0] += count
+            c[1] += error
+    return sorted([(key, c[0], c[1]) for key, c in merged.items()], key=lambda i: i[1], reverse=True)
+
+
+class TopTalkers:
+    def __init__(self, path, k=1000, period=86400, periods=8, interval=600):
+        # Heaviest http and tls hostnames by connections and bytes per period (a day by default) for
+        # the last few periods, ie a sliding window of whole periods.  Written to the snapshot file
+        # every interval seconds, and reloaded from it on start.
+
+        self.path = path
+        self.k = k
+        self.period = period
+        self.periods = periods
+        self.interval = interval
+
+        # Period start to {app: {'connections': SpaceSaving, 'bytes': SpaceSaving}}
+        self.__summaries = {}
+
+        # Summaries of the current period (start, end and summaries), saves the lookup per update
+        self.__current = (None, None, None)
+        self.__saved = time.time()
+
+        self.load()
+
+
+    def __period(self, now):
+        start, end, summaries = self.__current
+        if start is not None and start <= now < end:
+            return summaries
+
+        start = int(now // self.period * self.period)
+        summaries = self.__summaries.get(start)
+        if summaries is None:
+            summaries = self.__summaries[start] = {a: {'connections': SpaceSaving(self.k), 'bytes': SpaceSaving(self.k)}
+                                                   for a in [b'http', b'tls']}
+            for old in sorted(self.__summaries.keys())[:-self.periods]:
+                del self.__summaries[old]
+
+        self.__current = (start, start + self.period, summaries)
+        return summaries
+
+
+    def connection(self, app, hostname, now):
+        self.__period(now)[app]['connections'].add(hostname)
+
+
+    def transfer(self, app, hostname, count, now):
+        self.__period(now)[app]['bytes'].add(hostname, count)
+
+
+    def load(self):
+        try:
+            with open(self.path) as file:
+                snapshot = json.load(file)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logging.error('unable to load top talkers %s: %s', self.path, e)
+            return
+
+        if snapshot.get('period') != self.period:
+            logging.warning('top talkers %s has a different period, not loaded', self.path)
+            return
+
+        for start, apps in snapshot['periods'].items():
+            self.__summaries[int(start)] = {
+                app.encode(): {measure: SpaceSaving.load([(key.encode(), count, error) for key, count, error in items],
+                                                         self.k)
+                               for measure, items in measures.items()}
+                for app, measures in apps.items()
+            }
+
+
+    def save(self, now):
+        # Written atomically, hostnames are decoded (escape sequences are left as in the eve records)
+        snapshot = {
+            'period': self.period,
+            'updated': now,
+            'periods': {
+                str(start): {
+                    app.decode(): {measure: [(key.decode(errors='replace'), count, error)
+                                             for key, count, error in summary.items()]
+                                   for measure, summary in measures.items()}
+                    for app, measures in apps.items()
+                }
+                for start, apps in self.__summaries.items()
+            }
+        }
+
+        tmppath = self.path + '.tmp'
+        with open(tmppath, 'w') as file:
+            json.dump(snapshot, file, separators=(',', ':'))
+        os.replace(tmppath, self.path)
+
+        self.__saved = now
+
+
+    def maybe_save(self, now):
+        if now - self.__saved >= self.interval:
+            self.save(now)